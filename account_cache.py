@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger("personaai.account_cache")
+
+# Constants
+DEFAULT_ACCOUNT_CACHE_PATH = "account_cache.json"
+DEFAULT_ACCOUNT_CACHE_TTL = 10 * 60  # 10 minutes
+EXPIRATION_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+# Remembers the last credit-stat response per API key in a small JSON file so the
+# CLI doesn't have to validate the key over the network on every start. Entries
+# go stale after ttl seconds or once the account's expiratioDate has passed.
+# Keys are stored as SHA-256 digests, never in clear text.
+class AccountInfoCache:
+    def __init__(self, path=DEFAULT_ACCOUNT_CACHE_PATH, ttl=DEFAULT_ACCOUNT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    # Cached account info for api_key, or None if missing, stale or expired
+    def get(self, api_key):
+        with self.lock:
+            entry = self._load().get(_key_digest(api_key))
+        if not entry or time.time() - entry.get("fetched_at", 0) > self.ttl:
+            return None
+        account_info = entry.get("account_info") or {}
+        if account_expired(account_info):
+            return None
+        return account_info
+
+    def put(self, api_key, account_info):
+        with self.lock:
+            entries = self._load()
+            entries[_key_digest(api_key)] = {"account_info": account_info, "fetched_at": time.time()}
+            self._save(entries)
+
+    def invalidate(self, api_key):
+        with self.lock:
+            entries = self._load()
+            if entries.pop(_key_digest(api_key), None) is not None:
+                self._save(entries)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    # Write to a temporary file and swap it in so a crash never leaves half a file
+    def _save(self, entries):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Error saving account cache: %s", e)
+
+
+# True when the account's expiratioDate is in the past
+def account_expired(account_info):
+    value = account_info.get("expiratioDate")
+    if not value:
+        return False
+    try:
+        expires_at = datetime.strptime(value, EXPIRATION_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return False
+    return expires_at <= datetime.now(timezone.utc)
+
+
+def _key_digest(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+_default_cache = None
+
+
+# Shared cache; PERSONAAI_ACCOUNT_CACHE_PATH and PERSONAAI_ACCOUNT_CACHE_TTL change the defaults
+def get_account_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = AccountInfoCache(
+            path=os.environ.get("PERSONAAI_ACCOUNT_CACHE_PATH", DEFAULT_ACCOUNT_CACHE_PATH),
+            ttl=float(os.environ.get("PERSONAAI_ACCOUNT_CACHE_TTL", DEFAULT_ACCOUNT_CACHE_TTL)),
+        )
+    return _default_cache
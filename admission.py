@@ -0,0 +1,89 @@
+import math
+import os
+import threading
+
+from metrics import ADMISSION_PENDING, ADMISSION_REJECTIONS, log_event
+
+# Constants
+DEFAULT_MAX_PENDING = 200
+DEFAULT_MAX_PER_CLIENT = 5
+DEFAULT_RETRY_AFTER = 10  # seconds, until finished lookups give a better estimate
+
+# Rejection reasons
+CLIENT_LIMIT = "client_limit"
+OVERLOADED = "overloaded"
+
+
+# Raised by AdmissionController.admit() when a request has to be turned away
+class AdmissionRejected(Exception):
+    def __init__(self, message, status_code, retry_after, reason):
+        super().__init__(message)
+        self.status_code = status_code  # 429 for one busy client, 503 when the server is full
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+# Caps the analyses /analyze has admitted but not finished, in total and per
+# client, so a burst is answered at once with 429 or 503 and a Retry-After
+# instead of piling up behind busy workers. A limit of 0 turns that check off.
+class AdmissionController:
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, max_per_client=DEFAULT_MAX_PER_CLIENT,
+                 retry_after=DEFAULT_RETRY_AFTER, expected_duration=None):
+        self.max_pending = max_pending
+        self.max_per_client = max_per_client
+        self.default_retry_after = retry_after
+        self.expected_duration = expected_duration  # callable: typical seconds per lookup, or None
+        self.pending = 0
+        self.clients = {}  # client -> analyses pending
+        self.lock = threading.Lock()
+
+    # Count one analysis for client, or raise AdmissionRejected; pair with release()
+    def admit(self, client):
+        with self.lock:
+            if self.max_per_client and self.clients.get(client, 0) >= self.max_per_client:
+                reason = CLIENT_LIMIT
+            elif self.max_pending and self.pending >= self.max_pending:
+                reason = OVERLOADED
+            else:
+                self.pending += 1
+                self.clients[client] = self.clients.get(client, 0) + 1
+                ADMISSION_PENDING.set(self.pending)
+                return
+            pending = self.pending
+
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        retry_after = self.retry_after()
+        log_event("admission_rejected", reason=reason, pending=pending, retry_after=retry_after)
+        if reason == CLIENT_LIMIT:
+            raise AdmissionRejected(
+                f"You already have {self.max_per_client} analyses running. "
+                f"Please wait for one to finish and try again in {retry_after} seconds.", 429, retry_after, reason)
+        raise AdmissionRejected(
+            f"The server is busy with {pending} analyses. Please try again in {retry_after} seconds.",
+            503, retry_after, reason)
+
+    def release(self, client):
+        with self.lock:
+            count = self.clients.get(client, 0) - 1
+            if count > 0:
+                self.clients[client] = count
+            else:
+                self.clients.pop(client, None)
+            self.pending = max(0, self.pending - 1)
+            ADMISSION_PENDING.set(self.pending)
+
+    # Seconds a rejected client should wait: about one typical lookup, when known
+    def retry_after(self):
+        expected = self.expected_duration() if self.expected_duration else None
+        return max(1, math.ceil(expected)) if expected else self.default_retry_after
+
+
+# Controller configured through PERSONAAI_MAX_PENDING_ANALYSES, PERSONAAI_MAX_ANALYSES_PER_CLIENT
+# and PERSONAAI_ADMISSION_RETRY_AFTER
+def admission_from_env(expected_duration=None):
+    return AdmissionController(
+        max_pending=int(os.environ.get("PERSONAAI_MAX_PENDING_ANALYSES", DEFAULT_MAX_PENDING)),
+        max_per_client=int(os.environ.get("PERSONAAI_MAX_ANALYSES_PER_CLIENT", DEFAULT_MAX_PER_CLIENT)),
+        retry_after=int(os.environ.get("PERSONAAI_ADMISSION_RETRY_AFTER", DEFAULT_RETRY_AFTER)),
+        expected_duration=expected_duration,
+    )
@@ -1,301 +1,529 @@
-from flask import Flask, render_template, request, send_file
+from flask import Flask, render_template, request, send_file, jsonify, url_for, redirect, Response
+from markupsafe import Markup, escape
 import requests
-from cryptography.fernet import Fernet
 import os
-import time
-import json
+import hashlib
+import atexit
+import logging
+import threading
 from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, Table, TableStyle
-import re  # Import re module for regular expressions
+from urllib.parse import urlsplit
+from irbis_client import get_client
+from credentials import get_credentials
+from facebook_ids import normalize_facebook_id
+from jobs import JobQueue, AnalysisError, FINISHED, FAILED, then
+from async_poller import BackgroundPoller
+from poll_policy import default_policy
+from admission import admission_from_env, AdmissionRejected
+from irbis_client import EmptyProfileError, LookupNotFoundError
+from result_cache import get_result_cache
+from result_store import get_result_store, new_result_id
+from profile_model import Profile
+from pdf_renderer import render_profile_pdf, get_image_fetcher, LRUCache
+from bulk_export import build_combined_pdf, iter_zip
+from scheduler import get_scheduler, InsufficientCreditsError
+from key_pool import mask_key
+from singleflight import SingleFlight, get_shared_lookup_table
+from lookup_journal import claim_resume, record_trigger, unfinished_lookup, unfinished_lookups
+from search_index import get_search_index, index_profile
+from progress_stream import ProgressStreamServer
+from metrics import REGISTRY, CONTENT_TYPE, configure_logging, log_event, record_cache
+
+configure_logging()
+logger = logging.getLogger("personaai.app")
 
 app = Flask(__name__)
-
-API_KEY_FILE = "apikey.txt"
-KEY_FILE = "secret.key"
-PSYCHO_PROFILE_URL = "https://irbis.espysys.com/api/developer/psycho_profile"
-RESULTS_URL_TEMPLATE = "https://irbis.espysys.com/api/request-monitor/api-usage/{}?key={}"
-
-# Encryption key generation/loading functions
-def generate_key():
-    key = Fernet.generate_key()
-    with open(KEY_FILE, 'wb') as key_file:
-        key_file.write(key)
-
-def load_key():
-    if not os.path.exists(KEY_FILE):
-        generate_key()
-    return open(KEY_FILE, 'rb').read()
-
-def encrypt_message(message):
-    key = load_key()
-    encoded_message = message.encode()
-    f = Fernet(key)
-    encrypted_message = f.encrypt(encoded_message)
-    return encrypted_message
-
-def decrypt_message(encrypted_message):
-    key = load_key()
-    f = Fernet(key)
-    decrypted_message = f.decrypt(encrypted_message)
-    return decrypted_message.decode()
-
-# Retrieve the stored API key
+job_queue = JobQueue(workers=int(os.environ.get("PERSONAAI_JOB_WORKERS", 8)))
+poll_policy = default_policy()
+poller = BackgroundPoller(concurrency=int(os.environ.get("PERSONAAI_POLL_CONCURRENCY", 20)), policy=poll_policy)
+atexit.register(poller.shutdown)
+inflight = SingleFlight()
+# Bounds the analyses in progress; rejected clients are told to retry after about one typical lookup
+admission = admission_from_env(expected_duration=lambda: poll_policy.expected_completion)
+# Header naming the real client behind a reverse proxy (e.g. X-Real-IP); unset uses the socket address
+CLIENT_HEADER = os.environ.get("PERSONAAI_CLIENT_HEADER")
+
+BULK_EXPORT_MAX_RESULTS = int(os.environ.get("PERSONAAI_BULK_EXPORT_MAX", 500))
+RESULTS_PER_PAGE = int(os.environ.get("PERSONAAI_RESULTS_PER_PAGE", 10))
+SEARCH_RESULTS_PER_PAGE = 20
+IMAGE_MAX_AGE = 365 * 24 * 3600  # a result's thumbnail never changes
+
+# Rendered result fragments by result ID; a stored result never changes, so neither does its HTML
+_fragment_cache = LRUCache(int(os.environ.get("PERSONAAI_FRAGMENT_CACHE_SIZE", 512)))
+# Finished combined PDFs from /export/bulk by job ID, until downloaded or pushed out
+_bulk_exports = LRUCache(int(os.environ.get("PERSONAAI_BULK_EXPORT_KEEP", 16)))
+_profile_template = None
+
+# Progress events are streamed from the poller's event loop on their own port ("0" or "" turns it off)
+EVENTS_HOST = os.environ.get("PERSONAAI_EVENTS_HOST", "127.0.0.1")
+EVENTS_PORT = os.environ.get("PERSONAAI_EVENTS_PORT", "5001")
+EVENTS_URL = os.environ.get("PERSONAAI_EVENTS_URL")  # public base URL, e.g. behind a reverse proxy
+_progress_server = None
+_progress_server_lock = threading.Lock()
+_progress_server_failed = False
+
+# Retrieve the stored API key (cached in memory by the credential provider)
 def get_stored_api_key():
-    if os.path.exists(API_KEY_FILE):
-        with open(API_KEY_FILE, 'rb') as file:
-            encrypted_key = file.read()
-            return decrypt_message(encrypted_key)
-    return None
+    return get_credentials().get_api_key()
+
+# Every configured API key, primary first; triggers are spread across them
+def get_api_keys():
+    return get_credentials().get_api_keys()
 
 # Store a new API key
 def store_api_key(api_key):
-    encrypted_key = encrypt_message(api_key)
-    with open(API_KEY_FILE, 'wb') as file:
-        file.write(encrypted_key)
+    get_credentials().store_api_key(api_key)
 
 # Validate the API key by making a test request
 def validate_api_key(api_key):
-    response = requests.get(
-        f"https://irbis.espysys.com/api/request-monitor/credit-stat?key={api_key}",
-        headers={"Content-Type": "application/json"}
-    )
-    return response.status_code == 200
-
-# Function to validate Facebook ID
-def validate_facebook_id(facebook_id):
-    # Pattern for numeric ID (e.g., "100077649716158")
-    numeric_pattern = re.compile(r'^\d+$')
-    # Pattern for alphanumeric username with periods (e.g., "itaybar1", "eloy.simoesjr", "gwry.pwmrny.n.l.ymwz.whhzrh")
-    username_pattern = re.compile(r'^[a-zA-Z0-9._-]+$')
-
-    if numeric_pattern.match(facebook_id) or username_pattern.match(facebook_id):
-        return True
-    else:
+    try:
+        response = get_client().credit_stat(api_key)
+    except requests.RequestException as e:
+        logger.warning("Error validating API key: %s", e)
         return False
+    if response.status_code != 200:
+        return False
+    get_scheduler().credits.update(api_key, response.json())
+    return True
 
 # Trigger the psycho profile lookup
 def trigger_psycho_profile(api_key, facebook_id):
-    payload = {
-        "key": api_key,
-        "lookupType": "PSYCH",
-        "value": facebook_id,
-        "lookupId": 180
-    }
-    response = requests.post(PSYCHO_PROFILE_URL, headers={"Content-Type": "application/json"}, json=payload)
+    try:
+        response = get_scheduler().trigger(api_key, facebook_id)
+    except requests.RequestException as e:
+        logger.warning("Error initiating profile lookup: %s", e)
+        return None
     if response.status_code == 201:
-        return response.json().get('id')
-    return None
-
-# Poll for results until analysis is complete
-def poll_for_results(api_key, lookup_id):
-    url = RESULTS_URL_TEMPLATE.format(lookup_id, api_key)
-    finished_status_count = 0
-
-    while finished_status_count < 3:
-        response = requests.get(url, headers={"Content-Type": "application/json"})
-        if response.status_code == 200:
+        try:
             data = response.json()
-            print(f"API response received: {json.dumps(data, indent=2)}")  # Debug message for the full API response
-
-            if 'data' in data and len(data['data']) == 0:  # Empty data list
-                status = data.get('status')
-                if status == "finished":
-                    finished_status_count += 1
-                    if finished_status_count >= 3:
-                        return "Facebook profile is empty or does not exist", None
-            elif 'data' in data and len(data['data']) > 0:
-                status = data['data'][0]['status']
-                if status == "FINISHED":
-                    print("Profile analysis completed. Retrieving final data...")
-                    time.sleep(10)
-                    final_response = requests.get(url, headers={"Content-Type": "application/json"})
-                    final_data = final_response.json()
-                    print(f"Final API response received: {json.dumps(final_data, indent=2)}")  # Debug message for final API response
-                    if 'data' in final_data and len(final_data['data']) > 0:
-                        print("Final data retrieved.")
-                        return final_data['data'][0]['psychAnalyst']['profiles'][0], final_data['data'][0]['psychAnalyst'].get('image', '')
-            else:
-                print(f"Current status: {status}. Polling again in 5 seconds...")
-                time.sleep(5)  # Poll every 5 seconds
-        else:
-            print(f"Error retrieving status: {response.status_code}")
-            break
-    
-    return "Profile analysis failed. Please try again later.", None
+        except ValueError:
+            data = None  # e.g. a proxy's HTML page
+        lookup_id = data.get('id') if isinstance(data, dict) else None
+        if lookup_id:
+            record_trigger(facebook_id, lookup_id, api_key)
+        return lookup_id
+    return None
 
 @app.route('/')
 def home():
-    print("Rendering home page.")
+    logger.debug("Rendering home page.")
     return render_template('index.html')
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    facebook_id = request.form['facebook_id']
-    if not validate_facebook_id(facebook_id):
+    facebook_id = normalize_facebook_id(request.form['facebook_id'])
+    if facebook_id is None:
         return "Invalid Facebook ID format. Please enter a valid ID.", 400
 
-    api_key = get_stored_api_key()
-    if not api_key:
+    api_keys = get_api_keys()
+    if not api_keys:
         return "API key not found. Please set your API key in the settings.", 400
 
-    lookup_id = trigger_psycho_profile(api_key, facebook_id)
-    if not lookup_id:
-        return "Failed to initiate profile lookup. Please try again.", 500
-
-    profile_result, image_url = poll_for_results(api_key, lookup_id)
-    if profile_result is None:
-        return "Profile analysis failed. Please try again later.", 500
-    elif isinstance(profile_result, str):  # This will catch our custom message
-        return f"<div class='alert alert-danger'>{profile_result}</div>"
-
-    # Prepare result with emojis, colored danger level, and profile picture
-    name = profile_result.get('personName', 'Name not available')
-    psycho_portrait = profile_result.get('psychologicalPortrait', 'No data available')
-    danger_level = profile_result.get('levelOfDanger', 'No data available')
-    characteristics = profile_result.get('predictedCharacteristics', [])
-
-    # Store profile data in the session for PDF export
-    profile_data = {
-        "name": name,
-        "psycho_portrait": psycho_portrait,
-        "danger_level": danger_level,
-        "characteristics": characteristics,
-        "image_url": image_url
-    }
-    with open('profile_data.json', 'w') as f:
-        json.dump(profile_data, f)
-
-    formatted_output = f"""
-    <div style="display: flex; align-items: flex-start;">
-        <div style="margin-right: 20px; width: 200px;">
-            <img src="{image_url}" alt="Profile Picture" style="width: 200px; height: 200px; border-radius: 50%; object-fit: cover;" onerror="this.src='/static/default_profile.png';">
-        </div>
-        <div>
-            <span style="font-size: 28px; font-weight: bolder;">{name}</span><br><br>
-            <strong>🧠 PsychoPortrait:</strong><br>
-            <p style="text-align: left;">{psycho_portrait}</p><br>
-            <strong>⚠️ Level Of Danger:</strong> <span style='color: {"green" if danger_level.lower() == "low" else "red"};'>{danger_level}</span><br><br>
-            <strong>🔍 Predicted Characteristics:</strong><br>
-            <ul style="text-align: left;">
-            {"".join([f"<li>{c}</li>" for c in characteristics])}
-            </ul>
-        </div>
-    </div>
-    <div style="text-align: right; margin-top: 20px;">
-        <a href="/export" class="btn btn-primary" style="background-color: #007bff; color: white; text-decoration: none; padding: 10px 20px; border-radius: 5px;">Export to PDF</a>
-    </div>
-    """
-
-    return formatted_output
-
-@app.route('/export')
-def export_pdf():
-    # Load profile data from the session (or a file in this case)
-    with open('profile_data.json', 'r') as f:
-        profile_data = json.load(f)
-
-    return export_to_pdf(
-        profile_data['name'],
-        profile_data['psycho_portrait'],
-        profile_data['danger_level'],
-        profile_data['characteristics'],
-        profile_data['image_url']
-    )
-
-def export_to_pdf(name, psycho_portrait, danger_level, characteristics, image_url):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-
-    # Add a custom style for the title
-    title_style = ParagraphStyle(
-        'Title',
-        fontName="Helvetica-Bold",
-        fontSize=18,
-        textColor=colors.blue,
-        alignment=1,  # Center align
-    )
-
-    # Add a custom style for the subtitles
-    subtitle_style = ParagraphStyle(
-        'Subtitle',
-        fontName="Helvetica-Bold",
-        fontSize=14,
-        textColor=colors.black,
+    # Serve repeat lookups from the result cache without spending credits; a fresh analysis
+    # also skips resuming an earlier lookup
+    fresh = bool(request.form.get('no_cache'))
+    cached = None if fresh else get_result_cache().get(facebook_id)
+    if cached is not None:
+        job = job_queue.complete(facebook_id, store_profile(cached))
+    else:
+        # Turn the request away at once when this client or the server already has enough work
+        client = client_id()
+        try:
+            admission.admit(client)
+        except AdmissionRejected as e:
+            return str(e), e.status_code, {"Retry-After": str(e.retry_after)}
+        # Hand the lookup to the worker pool so this request returns immediately
+        job = job_queue.submit(facebook_id, run_analysis, api_keys, facebook_id, not fresh,
+                               on_done=lambda job: admission.release(client))
+    log_event("analyze", job_id=job.id, cached=cached is not None)
+    return jsonify({
+        "job_id": job.id,
+        "status_url": url_for('job_status', job_id=job.id),
+        "result_url": url_for('job_result', job_id=job.id),
+        "events_url": job_events_url(job.id),
+    }), 202
+
+# Who a request counts against for the per-client admission limit
+def client_id():
+    if CLIENT_HEADER:
+        forwarded = request.headers.get(CLIENT_HEADER, "")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.remote_addr
+
+# Start the progress stream on the poller loop the first time it is needed; None if it is off or failed
+def get_progress_server():
+    global _progress_server, _progress_server_failed
+    if EVENTS_PORT in ("", "0"):
+        return None
+    with _progress_server_lock:
+        if _progress_server is None and not _progress_server_failed:
+            server = ProgressStreamServer(job_queue.get, host=EVENTS_HOST, port=int(EVENTS_PORT))
+            try:
+                poller.run(server.start()).result(timeout=10)
+            except OSError as e:
+                # Another process already has the port; browsers fall back to polling /jobs
+                logger.warning("Progress stream disabled: %s", e)
+                _progress_server_failed = True
+            else:
+                _progress_server = server
+                atexit.register(lambda: poller.run(server.stop()).result(timeout=5))
+        return _progress_server
+
+# URL a browser can open with EventSource to follow a job, or None without a progress stream
+def job_events_url(job_id):
+    server = get_progress_server()
+    if server is None:
+        return None
+    base = EVENTS_URL or f"{request.scheme}://{urlsplit(request.host_url).hostname}:{server.port}"
+    return f"{base.rstrip('/')}/jobs/{job_id}/events"
+
+# Trigger and poll one lookup inside a job worker, joining an identical lookup if one is in flight
+def run_analysis(job, api_keys, facebook_id, resume=True):
+    future, leader = inflight.run(facebook_id, lambda: start_lookup(job, api_keys, facebook_id, resume))
+    record_cache("inflight", not leader)
+    if not leader:
+        job.update(message="Joined an identical analysis that is already in progress...", event="joined")
+    return then(future, lambda profile: finish_analysis(job, profile), on_error=describe_lookup_error)
+
+# Store a finished lookup's profile for the job and announce it; returns the result ID
+def finish_analysis(job, profile):
+    result_id = store_profile(profile)
+    job.update(message="Profile ready.", event="rendered", result_id=result_id)
+    return result_id
+
+# Trigger a lookup (or attach to one another worker started) and return a Future for its Profile.
+# New lookups go to the key the router picks; existing ones are polled with the key that started them.
+def start_lookup(job, api_keys, facebook_id, resume=True):
+    scheduler = get_scheduler()
+    shared = get_shared_lookup_table()
+    lookup_id = shared.acquire(facebook_id) if shared else None
+    owner = lookup_id is None
+    if owner:
+        # A lookup paid for before a restart or timeout is polled again rather than triggered twice,
+        # unless a fresh analysis was asked for
+        lookup_id, api_key = (unfinished_lookup(facebook_id, api_keys) if resume else None) or (None, None)
+        if lookup_id:
+            scheduler.keys.begin(api_key, lookup_id)
+            job.update(message="Resuming an analysis started earlier...", event="resumed", lookup_id=lookup_id)
+        else:
+            try:
+                lookup_id, api_key = trigger_with_key_pool(api_keys, facebook_id)
+            except AnalysisError:
+                if shared:
+                    shared.release(facebook_id)
+                raise
+            job.update(message="Profile lookup initiated. Waiting for IRBIS to finish...", event="triggered",
+                       lookup_id=lookup_id)
+        if shared:
+            shared.publish(facebook_id, lookup_id)
+    else:
+        api_key = scheduler.key_for_lookup(lookup_id, api_keys)
+        scheduler.keys.begin(api_key, lookup_id)
+        job.update(message="Joined an identical analysis running in another worker...", event="joined",
+                   lookup_id=lookup_id)
+
+    return poll_lookup(api_key, facebook_id, lookup_id,
+                       on_progress=lambda message, **data: job.update(message=message, **data),
+                       release=shared.release if owner and shared else None)
+
+# Trigger a new lookup with the key the router picks; returns (lookup_id, api_key)
+def trigger_with_key_pool(api_keys, facebook_id):
+    keys = get_scheduler().keys
+    try:
+        api_key = get_scheduler().choose_key(api_keys)
+    except InsufficientCreditsError as e:
+        raise AnalysisError(str(e))
+    # Until the lookup is started, any failure gives the key's in-flight slot back
+    try:
+        lookup_id = trigger_psycho_profile(api_key, facebook_id)
+        if not lookup_id:
+            raise AnalysisError("Failed to initiate profile lookup. Please try again.")
+    except InsufficientCreditsError as e:
+        keys.finish(api_key)
+        raise AnalysisError(str(e))
+    except BaseException:
+        keys.finish(api_key)
+        raise
+    keys.remember(lookup_id, api_key)
+    return lookup_id, api_key
+
+# Poll a triggered lookup (already counted against api_key by the key router) and return
+# a Future for its Profile. The shared poller owns the wait, so the calling worker is
+# free as soon as this returns.
+def poll_lookup(api_key, facebook_id, lookup_id, on_progress=None, release=None):
+    keys = get_scheduler().keys
+    future = poller.submit(api_key, lookup_id, on_progress=on_progress)
+    # The poller resolves future on its event loop; the cache, index and lock table writes run on a job worker
+    result = then(future, lambda record: cache_result(facebook_id, build_profile(record)),
+                  executor=job_queue.executor)
+    result.add_done_callback(lambda done: keys.finish(api_key))
+    if release:
+        result.add_done_callback(lambda done: release(facebook_id))
+    return result
+
+# Poll every lookup the journal still has open, e.g. after a deploy or a recycled worker.
+# Results go to the result cache, and a request for the same ID meanwhile joins the poll.
+# Only the first process to start claims this, so gunicorn workers don't each poll every lookup.
+def resume_unfinished_lookups():
+    if not claim_resume():
+        return 0
+    try:
+        shared = get_shared_lookup_table()
+        resumed = 0
+        for facebook_id, lookup_id, api_key in unfinished_lookups(get_api_keys()):
+            if shared:
+                if not shared.claim(facebook_id):
+                    continue  # another worker is already polling or triggering it
+                shared.publish(facebook_id, lookup_id)
+            get_scheduler().keys.begin(api_key, lookup_id)
+            inflight.run(facebook_id, lambda facebook_id=facebook_id, lookup_id=lookup_id, api_key=api_key: poll_lookup(
+                api_key, facebook_id, lookup_id, release=shared.release if shared else None))
+            log_event("lookup_resumed", lookup_id=lookup_id)
+            resumed += 1
+    except Exception:
+        logger.exception("Could not resume unfinished lookups")
+        return 0
+    if resumed:
+        logger.info("Resumed %d unfinished lookups", resumed)
+    return resumed
+
+# Remember a finished lookup so the next request for the same ID is a cache hit,
+# and make it searchable
+def cache_result(facebook_id, profile):
+    get_result_cache().put(facebook_id, profile)
+    index_profile(facebook_id, profile)
+    return profile
+
+# Show the upstream reason when IRBIS says the profile is empty or unknown
+def describe_lookup_error(e):
+    if isinstance(e, (EmptyProfileError, LookupNotFoundError)):
+        return AnalysisError(str(e))
+    return e
+
+# Parse a finished IRBIS record once into the Profile shown on the page and exported to PDF
+def build_profile(record):
+    profile = Profile.from_record(record)
+    if profile is None:
+        raise AnalysisError("Profile analysis failed. Please try again later.")
+    return profile
+
+# Keep a profile in the result store for viewing and export; returns its result ID
+def store_profile(profile):
+    # Warm the image cache off the request path so the first export doesn't wait on the image host
+    if profile.image_url:
+        job_queue.executor.submit(get_image_fetcher().fetch, profile.image_url)
+    return get_result_store().put(new_result_id(), profile)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    status = job.to_dict()
+    if job.status == FINISHED:
+        status["result_id"] = job.result
+        if _bulk_exports.get(job.id) is not None:
+            status["download_url"] = url_for('bulk_export_download', job_id=job.id)
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return "Job not found.", 404
+    if job.status == FAILED:
+        return f"<div class='alert alert-danger'>{escape(job.error)}</div>"
+    if job.status != FINISHED:
+        return jsonify(job.to_dict()), 202
+    fragment = get_profile_fragment(job.result)
+    if fragment is None:
+        return "Result no longer available. Please run the analysis again.", 410
+    return conditional_html(*fragment)
+
+# The HTML fragment for one stored result
+@app.route('/results/<result_id>')
+def result_fragment(result_id):
+    fragment = get_profile_fragment(result_id)
+    if fragment is None:
+        return "Result not found.", 404
+    return conditional_html(*fragment)
+
+# Many stored results on one paginated page: /results?id=...&id=...&page=2
+@app.route('/results')
+def results_page():
+    result_ids = request.args.getlist('id') or [i for i in request.args.get('ids', '').split(',') if i]
+    if not result_ids:
+        return "No result IDs given.", 400
+    if len(result_ids) > BULK_EXPORT_MAX_RESULTS:
+        return f"At most {BULK_EXPORT_MAX_RESULTS} results can be shown at once.", 400
+    per_page = max(1, min(request.args.get('per_page', RESULTS_PER_PAGE, type=int), 100))
+    pages = (len(result_ids) + per_page - 1) // per_page
+    page = max(1, min(request.args.get('page', 1, type=int), pages))
+    first = (page - 1) * per_page
+
+    fragments = [get_profile_fragment(result_id) for result_id in result_ids[first:first + per_page]]
+    if any(fragment is None for fragment in fragments):
+        return "Result not found.", 404
+
+    # The page is fully determined by its fragments and position, so check the ETag before rendering it
+    etag = content_etag(f"{page}/{pages}/{len(result_ids)}:" + ",".join(tag for _, tag in fragments))
+    if etag in request.if_none_match:
+        return conditional_html("", etag)
+    html = render_template(
+        'report.html', fragments=[html for html, _ in fragments], page=page, pages=pages,
+        total=len(result_ids), first=first + 1, last=first + len(fragments),
+        page_url=lambda number: url_for('results_page', id=result_ids, page=number, per_page=per_page),
     )
-
-    # Add a custom style for the text
-    text_style = ParagraphStyle(
-        'Text',
-        fontName="Helvetica",
-        fontSize=12,
-        textColor=colors.black,
+    return conditional_html(html, etag)
+
+# Search finished profiles in the local index: /search?q=...&danger=Low&characteristic=...&page=2.
+# Answers from the index alone, with no upstream calls; analyzing a hit's value is a cache hit.
+@app.route('/search')
+def search():
+    index = get_search_index()
+    if index is None:
+        return jsonify({"error": "Search is turned off."}), 404
+    per_page = max(1, min(request.args.get('per_page', SEARCH_RESULTS_PER_PAGE, type=int), 100))
+    found = index.search(
+        request.args.get('q', ''), danger=request.args.get('danger') or None,
+        characteristic=request.args.get('characteristic') or None,
+        page=request.args.get('page', 1, type=int), per_page=per_page,
     )
-
-    # Elements list to hold the components of the PDF
-    elements = []
-
-    # Logo and App Name as a single row (to align on the same line)
-    logo_path = "static/icon.png"  # Assuming you have a logo image in your static folder
-    if os.path.exists(logo_path):
-        # Adding the logo and title in a table to align them horizontally
-        logo = RLImage(logo_path, 0.8*inch, 0.8*inch)
-        title = Paragraph("PersonaAI", title_style)
-        table_data = [[logo, title]]
-        table = Table(table_data, colWidths=[1*inch, 4*inch])
-        table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        elements.append(table)
-        elements.append(Spacer(1, 12))
-    else:
-        elements.append(Paragraph("PersonaAI", title_style))
-        elements.append(Spacer(1, 20))
-
-    # Add profile image if available, and move it to the left
-    if image_url:
-        elements.append(RLImage(image_url, 2*inch, 2*inch))
-        elements.append(Spacer(1, 20))
-
-    # Add Name
-    elements.append(Paragraph(f"<b>{name}</b>", subtitle_style))
-    elements.append(Spacer(1, 12))
-
-    # Add PsychoPortrait with extra space
-    elements.append(Paragraph(f"🧠 <b>PsychoPortrait:</b>", subtitle_style))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(psycho_portrait, text_style))
-    elements.append(Spacer(1, 12))
-
-    # Add Level of Danger
-    elements.append(Paragraph(f"⚠️ <b>Level Of Danger:</b> <span color='{colors.green if danger_level.lower() == 'low' else colors.red}'>{danger_level}</span>", subtitle_style))
-    elements.append(Spacer(1, 12))
-
-    # Add Predicted Characteristics
-    elements.append(Paragraph(f"🔍 <b>Predicted Characteristics:</b>", subtitle_style))
-    elements.append(Spacer(1, 6))
-    for characteristic in characteristics:
-        elements.append(Paragraph(f"- {characteristic}", text_style))
-
-    # Build the PDF
-    doc.build(elements)
-
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name="profile_report.pdf", mimetype='application/pdf')
+    found["per_page"] = per_page
+    return jsonify(found)
+
+# Profile thumbnail for a stored result, fetched from the image host once and then
+# served from the thumbnail cache, so result pages don't hotlink the upstream image
+@app.route('/images/<result_id>')
+def profile_image(result_id):
+    profile = get_result_store().get(result_id)
+    if profile is None:
+        return "Result not found.", 404
+    image_bytes = get_image_fetcher().fetch(profile.image_url)
+    if not image_bytes:
+        return redirect(url_for('static', filename='default_profile.png'))
+    response = Response(image_bytes, mimetype='image/jpeg')
+    response.set_etag(content_etag(result_id))
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+# Rendered fragment and ETag for a stored result, or None if it isn't stored
+def get_profile_fragment(result_id):
+    fragment = _fragment_cache.get(result_id)
+    record_cache("fragment", fragment is not None)
+    if fragment is None:
+        profile = get_result_store().get(result_id)
+        if profile is None:
+            return None
+        html = render_profile_html(result_id, profile)
+        fragment = (html, content_etag(html))
+        _fragment_cache.put(result_id, fragment)
+    return fragment
+
+# Build the HTML fragment shown for a finished analysis from the precompiled, autoescaped template
+def render_profile_html(result_id, profile):
+    global _profile_template
+    if _profile_template is None:
+        _profile_template = app.jinja_env.get_template('profile_result.html')
+    return Markup(_profile_template.render(result_id=result_id, profile=profile))
+
+def content_etag(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+# HTML response that browsers revalidate with If-None-Match; unchanged results get a 304
+def conditional_html(html, etag):
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/export/<result_id>')
+def export_pdf(result_id):
+    profile = get_result_store().get(result_id)
+    if profile is None:
+        return "Result not found.", 404
+
+    pdf, digest = render_profile_pdf(profile)
+    return send_file(BytesIO(pdf), as_attachment=True, download_name="profile_report.pdf",
+                     mimetype='application/pdf', etag=digest)
+
+@app.route('/export/bulk', methods=['POST'])
+def export_bulk():
+    payload = request.get_json(silent=True) or {}
+    result_ids = payload.get('result_ids') or request.form.getlist('result_id')
+    export_format = payload.get('format') or request.form.get('format', 'pdf')
+    if not result_ids:
+        return jsonify({"error": "No result IDs given."}), 400
+    if len(result_ids) > BULK_EXPORT_MAX_RESULTS:
+        return jsonify({"error": f"At most {BULK_EXPORT_MAX_RESULTS} results can be exported at once."}), 400
+    if export_format not in ("pdf", "zip"):
+        return jsonify({"error": "Format must be pdf or zip."}), 400
+
+    store = get_result_store()
+    profiles = [store.get(result_id) for result_id in result_ids]
+    missing = [result_id for result_id, profile in zip(result_ids, profiles) if profile is None]
+    if missing:
+        return jsonify({"error": "Results not found.", "result_ids": missing}), 404
+
+    if export_format == "zip":
+        return Response(iter_zip(profiles), mimetype='application/zip',
+                        headers={"Content-Disposition": "attachment; filename=profile_reports.zip"})
+    # The combined PDF can't be streamed (its contents page needs every page count first),
+    # so it is built on a job worker and downloaded once the job has finished
+    job = job_queue.submit(None, build_bulk_pdf, profiles)
+    return jsonify({"job_id": job.id, "status_url": url_for('job_status', job_id=job.id),
+                    "download_url": url_for('bulk_export_download', job_id=job.id)}), 202
+
+def build_bulk_pdf(job, profiles):
+    job.update(message=f"Rendering {len(profiles)} profiles...")
+    _bulk_exports.put(job.id, build_combined_pdf(profiles))
+
+@app.route('/export/bulk/<job_id>')
+def bulk_export_download(job_id):
+    pdf = _bulk_exports.get(job_id)
+    if pdf is not None:
+        return send_file(BytesIO(pdf), as_attachment=True, download_name="profile_reports.pdf",
+                         mimetype='application/pdf')
+    job = job_queue.get(job_id)
+    if job is not None and not job.done:
+        return jsonify(job.to_dict()), 202
+    if job is not None and job.status == FAILED:
+        return jsonify({"error": job.error}), 500
+    return jsonify({"error": "Export not found or no longer available."}), 404
+
+# Prometheus metrics for this process
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
     if request.method == 'POST':
+        action = request.form.get('action', 'save')
+        if action == 'remove':
+            # Keys are never sent to the page, so removal goes by position in the key list
+            api_keys = get_api_keys()
+            index = request.form.get('key_index', type=int)
+            if index is not None and 0 <= index < len(api_keys) and get_credentials().remove_api_key(api_keys[index]):
+                message = "API key removed."
+                message_type = "alert-success"
+            else:
+                message = "That API key can't be removed here."
+                message_type = "alert-danger"
+            return render_settings(get_stored_api_key(), message=message, message_type=message_type)
+
         api_key = request.form.get('apikey')
         if api_key:
             if validate_api_key(api_key):
-                store_api_key(api_key)
-                message = "API key saved successfully!"
+                if action == 'add':
+                    get_credentials().add_api_key(api_key)
+                    message = "API key added to the key pool!"
+                else:
+                    store_api_key(api_key)
+                    message = "API key saved successfully!"
                 message_type = "alert-success"  # Bootstrap class for success
             else:
                 message = "Invalid API key. Please try again."
@@ -304,16 +532,21 @@ def settings():
             message = "API key is required."
             message_type = "alert-danger"
 
-        return render_template('settings.html', api_key=sanitize_api_key(api_key), message=message, message_type=message_type)
+        return render_settings(api_key if action != 'add' else get_stored_api_key(), message=message, message_type=message_type)
 
     # GET request or no API key submitted
-    api_key = get_stored_api_key() or ""
-    return render_template('settings.html', api_key=sanitize_api_key(api_key))
-
-def sanitize_api_key(api_key):
-    if api_key:
-        return f"${'*' * (len(api_key) - 5)}{api_key[-5:]}"
-    return ""
+    return render_settings(get_stored_api_key())
+
+# Settings page with the current key and, per pooled key, what the router knows about it
+def render_settings(api_key, **messages):
+    pool = get_scheduler().keys.snapshot(get_api_keys())
+    return render_template('settings.html', api_key=mask_key(api_key), pool=pool, **messages)
+
+# Pick up lookups a previous process left unfinished, off the import path. Under the debug
+# reloader that is the serving child process (WERKZEUG_RUN_MAIN), not the file watcher.
+if os.environ.get("PERSONAAI_RESUME_LOOKUPS", "1") == "1" and (
+        __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+    job_queue.executor.submit(resume_unfinished_lookups)
 
 if __name__ == '__main__':
     app.run(debug=True)
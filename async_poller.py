@@ -0,0 +1,311 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+
+import aiohttp
+
+from irbis_client import (
+    IRBIS_BASE_URL, PSYCHO_PROFILE_PATH, RESULTS_PATH_TEMPLATE, JSON_HEADERS, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT,
+    LOOKUP_EMPTY, LOOKUP_FINISHED, IrbisError, LookupNotFoundError, EmptyProfileError, lookup_state,
+    profile_ready,
+)
+from lookup_journal import record_trigger, record_outcome, DONE, FAILED, GAVE_UP
+from metrics import TRIGGER_SECONDS, STATUS_CHECK_SECONDS, record_lookup
+from poll_policy import default_policy
+from scheduler import get_scheduler, MAX_TRIGGER_ATTEMPTS
+
+logger = logging.getLogger("personaai.poller")
+
+# Constants
+DEFAULT_CONCURRENCY = 20
+EMPTY_FINISHED_LIMIT = 3
+MAX_CONSECUTIVE_ERRORS = 5
+
+
+# One outstanding lookup tracked by the poller
+class PendingLookup:
+    def __init__(self, api_key, lookup_id, future, on_progress=None):
+        self.api_key = api_key
+        self.lookup_id = lookup_id
+        self.future = future
+        self.on_progress = on_progress
+        self.attempts = 0
+        self.empty_count = 0
+        self.error_count = 0
+        self.finalizing = False
+        self.last_fetch = None
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    # Report progress as on_progress(message, event=..., **data)
+    def progress(self, message, event="progress", **data):
+        if self.on_progress:
+            try:
+                self.on_progress(message, event=event, **data)
+            except Exception as e:
+                logger.warning("Progress callback failed for lookup %s: %s", self.lookup_id, e)
+
+
+# Polls many IRBIS lookups from one event loop over one shared connection pool.
+# Lookups wait in a heap ordered by their next due time; due lookups are checked
+# concurrently, at most `concurrency` status GETs at a time. The wait between
+# checks comes from a poll_policy.PollPolicy.
+class AsyncPoller:
+    def __init__(self, base_url=IRBIS_BASE_URL, concurrency=DEFAULT_CONCURRENCY, policy=None,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, scheduler=None):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.policy = policy or default_policy()
+        self.scheduler = scheduler or get_scheduler()
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+        self.semaphore = None
+        self.queue = []
+        self.counter = itertools.count()
+        self.wakeup = None
+        self.runner = None
+        self.tasks = set()
+
+    async def start(self):
+        if self.session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, headers=JSON_HEADERS, timeout=self.timeout)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.wakeup = asyncio.Event()
+        self.runner = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self.runner is not None:
+            self.runner.cancel()
+            self.runner = None
+        for task in list(self.tasks):
+            task.cancel()
+        for _, _, lookup in self.queue:
+            if not lookup.future.done():
+                lookup.future.cancel()
+        self.queue = []
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @property
+    def in_flight(self):
+        return len(self.queue) + len(self.tasks)
+
+    # Start a psycho profile lookup over the shared session and return its lookup ID.
+    # Only 429s are retried: any other answer may already have cost credits.
+    async def trigger(self, api_key, facebook_id):
+        await self.start()
+        payload = {
+            "key": api_key,
+            "lookupType": "PSYCH",
+            "value": facebook_id,
+            "lookupId": 180
+        }
+        loop = asyncio.get_running_loop()
+        for attempt in range(MAX_TRIGGER_ATTEMPTS):
+            # May refresh the credit balance over HTTP, so keep it off the event loop
+            await asyncio.sleep(await loop.run_in_executor(None, self.scheduler.reserve_trigger, api_key))
+            try:
+                async with self.semaphore:
+                    started = time.perf_counter()
+                    async with self.session.post(f"{self.base_url}{PSYCHO_PROFILE_PATH}", json=payload) as response:
+                        text = await response.text()
+                        elapsed = time.perf_counter() - started
+                        TRIGGER_SECONDS.observe(elapsed)
+                        logger.debug("POST trigger %s -> %s in %.3fs", facebook_id, response.status, elapsed)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise IrbisError(f"Error initiating profile lookup: {e}")
+            self.scheduler.note_response(response.status, response.headers.get("Retry-After"), api_key)
+            if response.status != 429:
+                break
+        if response.status != 201:
+            raise IrbisError(f"Error initiating profile lookup: {response.status} {text}")
+        self.scheduler.credits.consume(api_key)
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None  # e.g. a proxy's HTML page
+        lookup_id = data.get('id') if isinstance(data, dict) else None
+        if not lookup_id:
+            raise IrbisError("Error initiating profile lookup: no lookup ID returned")
+        await asyncio.get_running_loop().run_in_executor(None, record_trigger, facebook_id, lookup_id, api_key)
+        return lookup_id
+
+    # Start polling a lookup; the returned future resolves to the finished IRBIS record
+    async def poll(self, api_key, lookup_id, on_progress=None):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._schedule(PendingLookup(api_key, lookup_id, future, on_progress), self.policy.next_delay(1, 0))
+        return await future
+
+    def _schedule(self, lookup, delay):
+        heapq.heappush(self.queue, (time.monotonic() + delay, next(self.counter), lookup))
+        self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, lookup = heapq.heappop(self.queue)
+                if lookup.future.done():
+                    continue
+                task = asyncio.ensure_future(self._check(lookup))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+            self.wakeup.clear()
+            timeout = self.queue[0][0] - now if self.queue else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fetch(self, lookup):
+        url = f"{self.base_url}{RESULTS_PATH_TEMPLATE.format(lookup.lookup_id)}"
+        await asyncio.sleep(self.scheduler.reserve_poll(lookup.api_key))
+        async with self.semaphore:
+            started = time.perf_counter()
+            async with self.session.get(url, params={"key": lookup.api_key}) as response:
+                data = await response.json(content_type=None) if response.status == 200 else None
+                if response.status == 200 and not isinstance(data, dict):
+                    raise ValueError("status response is not a JSON object")
+                lookup.last_fetch = time.perf_counter() - started
+                STATUS_CHECK_SECONDS.observe(lookup.last_fetch)
+                logger.debug("GET status %s -> %s in %.3fs", lookup.lookup_id, response.status, lookup.last_fetch)
+                self.scheduler.note_response(response.status, response.headers.get("Retry-After"), lookup.api_key)
+                return response.status, data
+
+    # Check one lookup; a bug or an unexpected answer fails its future rather than leaving it pending forever
+    async def _check(self, lookup):
+        try:
+            await self._check_status(lookup)
+        except Exception as e:
+            logger.exception("Status check for lookup %s failed", lookup.lookup_id)
+            if not lookup.future.done():
+                await self._fail(lookup, IrbisError(f"Error retrieving status: {e}"), "error")
+
+    async def _check_status(self, lookup):
+        if lookup.future.done():
+            return
+        lookup.attempts += 1
+        lookup.progress(f"Checking status (attempt {lookup.attempts})...", event="poll", attempt=lookup.attempts)
+        try:
+            status_code, data = await self._fetch(lookup)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # ValueError: a 200 that isn't a JSON object, e.g. a proxy's HTML error page
+            await self._retry_after_error(lookup, f"Error retrieving status: {e}")
+            return
+
+        if lookup.future.done():
+            return
+        if status_code == 404:
+            await self._fail(lookup, LookupNotFoundError("Data not found or invalid request"), "not_found")
+            return
+        if status_code != 200:
+            await self._retry_after_error(lookup, f"Error retrieving status: {status_code}")
+            return
+        lookup.error_count = 0
+
+        state, record = lookup_state(data)
+        if state == LOOKUP_EMPTY:
+            lookup.empty_count += 1
+            if lookup.empty_count >= EMPTY_FINISHED_LIMIT:
+                await self._fail(lookup, EmptyProfileError("Facebook profile is empty or does not exist"), "empty")
+                return
+            lookup.progress("IRBIS reports no data yet...", event="status", state="empty")
+        elif state == LOOKUP_FINISHED:
+            if profile_ready(record):
+                self.policy.record_completion(lookup.elapsed)
+                record_lookup(lookup.lookup_id, "finished", lookup.elapsed, lookup.attempts, lookup.last_fetch)
+                # Journal writes are SQLite calls that may wait on a lock, so keep them off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, record_outcome, lookup.lookup_id, DONE)
+                if not lookup.future.done():
+                    lookup.future.set_result(record)
+                return
+            # IRBIS can flip to FINISHED before the profile is written; re-check on a short interval
+            if not lookup.finalizing:
+                lookup.finalizing = True
+                lookup.progress("Profile analysis completed. Retrieving final data...", event="status",
+                                state="finalizing")
+            await self._reschedule(lookup, self.policy.ready_delay())
+            return
+        lookup.progress(f"IRBIS is still analyzing the profile (check {lookup.attempts})...", event="status",
+                        state="pending")
+        await self._reschedule(lookup, self.policy.next_delay(lookup.attempts + 1, lookup.elapsed))
+
+    # Queue the next check unless the lookup has run past the policy deadline
+    async def _reschedule(self, lookup, delay):
+        if self.policy.expired(lookup.elapsed + delay):
+            await self._fail(lookup, IrbisError("Timed out waiting for the profile analysis to finish"), "timeout")
+        else:
+            self._schedule(lookup, delay)
+
+    # Final answers close the journal entry; timeouts and errors leave it resumable a limited number of times.
+    # The journal is written before the caller hears of the failure, as for a finished lookup.
+    async def _fail(self, lookup, error, outcome):
+        record_lookup(lookup.lookup_id, outcome, lookup.elapsed, lookup.attempts)
+        state = FAILED if isinstance(error, (LookupNotFoundError, EmptyProfileError)) else GAVE_UP
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, record_outcome, lookup.lookup_id, state)
+        except Exception:
+            logger.exception("Could not journal the outcome of lookup %s", lookup.lookup_id)
+        finally:
+            if not lookup.future.done():
+                lookup.future.set_exception(error)
+
+    async def _retry_after_error(self, lookup, message):
+        if lookup.future.done():
+            return
+        logger.warning("Lookup %s: %s", lookup.lookup_id, message)
+        lookup.error_count += 1
+        if lookup.error_count >= MAX_CONSECUTIVE_ERRORS:
+            await self._fail(lookup, IrbisError(message), "error")
+        else:
+            await self._reschedule(lookup, self.policy.next_delay(lookup.attempts + 1, lookup.elapsed))
+
+
+# Runs an AsyncPoller on its own event loop thread for use from synchronous code
+class BackgroundPoller:
+    def __init__(self, **poller_options):
+        self.poller_options = poller_options
+        self.poller = None
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.loop is not None:
+                return
+            self.poller = AsyncPoller(**self.poller_options)
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="personaai-poller", daemon=True)
+            self.thread.start()
+
+    # Start polling from any thread; returns a concurrent.futures.Future
+    def submit(self, api_key, lookup_id, on_progress=None):
+        self._ensure_started()
+        return self.run(self.poller.poll(api_key, lookup_id, on_progress))
+
+    # Run any coroutine on the poller's event loop (e.g. a server sharing it); returns a concurrent Future
+    def run(self, coroutine):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def shutdown(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.poller.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from async_poller import AsyncPoller
+from irbis_client import IrbisError, EmptyProfileError, LookupNotFoundError
+from lookup_journal import unfinished_lookup
+from profile_model import Profile, LookupResult
+from search_index import index_profile
+
+logger = logging.getLogger("personaai.batch")
+
+# Constants
+DEFAULT_BATCH_CONCURRENCY = 5
+DEFAULT_MAX_IN_FLIGHT = 100  # IDs being looked up at once; the rest of the input is read as slots free up
+
+# Checkpoint states
+TRIGGERED = "triggered"
+DONE = "done"
+FAILED = "failed"
+
+
+# Append-only JSONL record of batch progress, so an interrupted run can resume
+# without re-triggering (and paying for) lookups that were already started
+class Checkpoint:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a torn last line from an interrupted run
+                    self.entries[entry['value']] = entry
+        self.file = open(path, 'a') if path else None
+
+    def state(self, value):
+        entry = self.entries.get(value)
+        return entry['state'] if entry else None
+
+    def lookup_id(self, value):
+        entry = self.entries.get(value)
+        return entry.get('lookup_id') if entry else None
+
+    def record(self, value, state, lookup_id=None):
+        entry = {"value": value, "state": state, "lookup_id": lookup_id}
+        self.entries[value] = entry
+        if self.file:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+# Trigger, poll and write every ID, serving cache hits without a lookup when a
+# result_cache.ResultCache is given; returns (finished, failed) counts. Lookups
+# are spread over api_keys (primary first) by the scheduler's key router. At most
+# `concurrency` triggers run at once and at most max_in_flight IDs are in progress,
+# so the input is streamed rather than read up front. With resume=False, lookups
+# the journal has open are not picked up; the checkpoint still is.
+def run_batch(api_keys, facebook_ids, results_stream, checkpoint_path=None,
+              concurrency=DEFAULT_BATCH_CONCURRENCY, policy=None, cache=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+              resume=True):
+    return asyncio.run(_run_batch(api_keys, facebook_ids, results_stream, checkpoint_path, concurrency, policy, cache,
+                                  max_in_flight, resume))
+
+
+async def _run_batch(api_keys, facebook_ids, results_stream, checkpoint_path, concurrency, policy, cache,
+                     max_in_flight, resume):
+    checkpoint = Checkpoint(checkpoint_path)
+    poller = AsyncPoller(policy=policy)
+    scheduler = poller.scheduler
+    loop = asyncio.get_running_loop()
+    trigger_slots = asyncio.Semaphore(concurrency)
+    counts = {DONE: 0, FAILED: 0}
+
+    def write_result(facebook_id, lookup_id, profile):
+        results_stream.write(LookupResult(facebook_id, lookup_id, profile).to_json() + "\n")
+        results_stream.flush()
+        checkpoint.record(facebook_id, DONE, lookup_id)
+
+    async def process(facebook_id):
+        cached = cache.get(facebook_id) if cache is not None else None
+        if cached is not None:
+            write_result(facebook_id, None, cached)
+            return
+        # The checkpoint knows this batch's lookups; the journal also covers runs without one.
+        # Either way the lookup is polled with the key that triggered it.
+        lookup_id = checkpoint.lookup_id(facebook_id)
+        if lookup_id:
+            api_key = scheduler.key_for_lookup(lookup_id, api_keys)
+        elif resume:
+            lookup_id, api_key = unfinished_lookup(facebook_id, api_keys) or (None, None)
+        resumed = lookup_id is not None
+        if resumed:
+            scheduler.keys.begin(api_key, lookup_id)
+            print(f"Resuming lookup {lookup_id} for {facebook_id}")
+        else:
+            async with trigger_slots:
+                # Reading a key's balance may mean a credit-stat call, so keep it off the event loop
+                api_key = await loop.run_in_executor(None, scheduler.choose_key, api_keys)
+                try:
+                    lookup_id = await poller.trigger(api_key, facebook_id)
+                except BaseException:
+                    scheduler.keys.finish(api_key)
+                    raise
+
+        # The key counts this lookup as in flight until it stops polling, however that happens
+        try:
+            if not resumed:
+                scheduler.keys.remember(lookup_id, api_key)
+                checkpoint.record(facebook_id, TRIGGERED, lookup_id)
+                print(f"Profile lookup initiated for {facebook_id}. ID: {lookup_id}")
+            record = await poller.poll(api_key, lookup_id)
+        except (EmptyProfileError, LookupNotFoundError):
+            # Final answers from IRBIS: don't retry these on resume
+            checkpoint.record(facebook_id, FAILED, lookup_id)
+            raise
+        finally:
+            scheduler.keys.finish(api_key)
+
+        profile = Profile.from_record(record)
+        if cache is not None:
+            cache.put(facebook_id, profile)
+        index_profile(facebook_id, profile)
+        write_result(facebook_id, lookup_id, profile)
+
+    # One failed row, whatever the cause, is counted and reported without stopping the batch
+    async def process_and_count(facebook_id):
+        try:
+            await process(facebook_id)
+            counts[DONE] += 1
+        except IrbisError as e:
+            counts[FAILED] += 1
+            print(f"{facebook_id}: {e}")
+        except Exception as e:
+            logger.exception("Unexpected error processing %s", facebook_id)
+            counts[FAILED] += 1
+            print(f"{facebook_id}: unexpected error: {e}")
+
+    # Workers share one iterator over the input, so IDs are read only as a worker frees up
+    ids = iter(facebook_ids)
+
+    async def worker():
+        for facebook_id in ids:
+            if checkpoint.state(facebook_id) in (DONE, FAILED):
+                continue
+            await process_and_count(facebook_id)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(concurrency, max_in_flight))))
+    finally:
+        await poller.close()
+        checkpoint.close()
+
+    return counts[DONE], counts[FAILED]
+
+
+# Open the batch input: a path, or "-" for stdin
+def open_ids_source(path):
+    if path == "-":
+        return sys.stdin
+    return open(path, 'r')
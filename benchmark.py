@@ -0,0 +1,258 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_irbis import FakeIrbisServer, add_config_arguments, config_from_args, STATS_PATH
+
+# Constants
+BENCHMARK_API_KEY = "BENCHMARK-KEY-00000"
+DEFAULT_LOOKUPS = 20
+DEFAULT_CONCURRENCY = 5
+DEFAULT_JOB_POLL_INTERVAL = 0.1
+DEFAULT_TIMEOUT = 300
+PERSONAAI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "personaai.py")
+
+
+# Outcome of one benchmarked lookup
+class LookupTiming:
+    def __init__(self, ok, latency, error=None, analyze_latency=None, export_latency=None):
+        self.ok = ok
+        self.latency = latency
+        self.error = error
+        self.analyze_latency = analyze_latency
+        self.export_latency = export_latency
+
+
+# Nearest-rank percentile of a list of numbers, or None if it is empty
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+# Point the CLI and the web app at the IRBIS server under test, with a throwaway
+# key and caches so runs never touch real credentials or earlier results.
+# Must run before app/personaai are imported: they read these at import time.
+def configure_environment(irbis_url, workdir):
+    os.environ["IRBIS_BASE_URL"] = irbis_url
+    os.environ["PERSONAAI_API_KEY"] = os.environ.get("PERSONAAI_API_KEY", BENCHMARK_API_KEY)
+    os.environ["PERSONAAI_CACHE_PATH"] = os.path.join(workdir, "result_cache.db")
+    os.environ["PERSONAAI_ACCOUNT_CACHE_PATH"] = os.path.join(workdir, "account_cache.json")
+    os.environ["PERSONAAI_JOURNAL_PATH"] = os.path.join(workdir, "lookup_journal.db")
+    os.environ["PERSONAAI_SEARCH_INDEX_PATH"] = os.path.join(workdir, "search_index.db")
+    os.environ["PERSONAAI_IMAGE_CACHE_DIR"] = os.path.join(workdir, "image_cache")
+    # The in-process app would otherwise bind the progress-stream port a running server may hold
+    os.environ["PERSONAAI_EVENTS_PORT"] = "0"
+    # Every benchmark request comes from this host, so the per-client limit would cap --concurrency
+    os.environ.setdefault("PERSONAAI_MAX_ANALYSES_PER_CLIENT", "0")
+
+
+def fetch_upstream_stats(irbis_url):
+    import requests
+    try:
+        response = requests.get(f"{irbis_url}{STATS_PATH}", timeout=5)
+    except requests.RequestException:
+        return None
+    return response.json() if response.status_code == 200 else None
+
+
+# Drives the Flask app in this process through its test client (one per thread)
+class InProcessApp:
+    def __init__(self):
+        import app
+        self.app = app.app
+        self.local = threading.local()
+
+    def request(self, method, path, data=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, data=data)
+        return response.status_code, response.get_data()
+
+
+# Drives an already running web app over HTTP
+class RemoteApp:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.local = threading.local()
+
+    def request(self, method, path, data=None):
+        import requests
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        response = session.request(method, f"{self.base_url}{path}", data=data, timeout=DEFAULT_TIMEOUT)
+        return response.status_code, response.content
+
+
+# One /analyze -> job polling -> /export round trip
+def run_web_lookup(web_app, facebook_id, poll_interval, timeout):
+    started = time.perf_counter()
+    status_code, body = web_app.request("POST", "/analyze", {"facebook_id": facebook_id, "no_cache": "1"})
+    if status_code != 202:
+        return LookupTiming(False, time.perf_counter() - started, f"/analyze returned {status_code}")
+    status_url = json.loads(body)["status_url"]
+
+    while True:
+        status_code, body = web_app.request("GET", status_url)
+        job = json.loads(body) if status_code == 200 else {}
+        if job.get("status") in ("finished", "failed"):
+            break
+        if time.perf_counter() - started > timeout:
+            return LookupTiming(False, time.perf_counter() - started, "timed out")
+        time.sleep(poll_interval)
+    analyzed = time.perf_counter()
+    if job["status"] == "failed":
+        return LookupTiming(False, analyzed - started, job.get("error"), analyze_latency=analyzed - started)
+
+    status_code, body = web_app.request("GET", f"/export/{job['result_id']}")
+    finished = time.perf_counter()
+    if status_code != 200 or not body.startswith(b"%PDF"):
+        return LookupTiming(False, finished - started, f"/export returned {status_code}",
+                            analyze_latency=analyzed - started)
+    return LookupTiming(True, finished - started, analyze_latency=analyzed - started,
+                        export_latency=finished - analyzed)
+
+
+# One `personaai.py -q -id` run in a fresh process, the way scripts call the CLI
+def run_cli_lookup(facebook_id, timeout):
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(
+            [sys.executable, PERSONAAI_SCRIPT, "-q", "--no-cache", "-id", facebook_id],
+            capture_output=True, text=True, timeout=timeout, stdin=subprocess.DEVNULL,
+        )
+    except subprocess.TimeoutExpired:
+        return LookupTiming(False, time.perf_counter() - started, "timed out")
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0 or "Psychological Profile" not in result.stdout:
+        # Last meaningful stdout line; tqdm progress bars go to stderr
+        lines = [line.strip(" *") for line in result.stdout.splitlines() if line.strip(" *")]
+        return LookupTiming(False, elapsed, lines[-1] if lines else f"exit code {result.returncode}")
+    return LookupTiming(True, elapsed)
+
+
+# Run `lookups` lookups with at most `concurrency` at once and summarise them
+def run_benchmark(mode, lookup, lookups, concurrency, irbis_url):
+    run_id = uuid.uuid4().hex[:8]
+    facebook_ids = [f"bench{run_id}.{index}" for index in range(lookups)]
+
+    before = fetch_upstream_stats(irbis_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(lookup, facebook_ids))
+    wall_time = time.perf_counter() - started
+    after = fetch_upstream_stats(irbis_url)
+
+    return summarize(mode, timings, concurrency, wall_time, before, after)
+
+
+def summarize(mode, timings, concurrency, wall_time, before, after):
+    ok = [timing for timing in timings if timing.ok]
+    latencies = [timing.latency for timing in ok]
+    summary = {
+        "mode": mode,
+        "lookups": len(timings),
+        "concurrency": concurrency,
+        "succeeded": len(ok),
+        "failed": len(timings) - len(ok),
+        "errors": sorted({timing.error for timing in timings if timing.error}),
+        "wall_time": wall_time,
+        "lookups_per_second": len(ok) / wall_time if wall_time else None,
+        "latency": {f"p{pct}": percentile(latencies, pct) for pct in (50, 95, 99)},
+    }
+    analyze = [timing.analyze_latency for timing in ok if timing.analyze_latency is not None]
+    export = [timing.export_latency for timing in ok if timing.export_latency is not None]
+    if analyze:
+        summary["analyze_latency"] = {f"p{pct}": percentile(analyze, pct) for pct in (50, 95, 99)}
+    if export:
+        summary["export_latency"] = {f"p{pct}": percentile(export, pct) for pct in (50, 95, 99)}
+    if before is not None and after is not None and timings:
+        summary["upstream_calls_per_lookup"] = {
+            kind: (after[kind] - before[kind]) / len(timings)
+            for kind in ("trigger", "status", "credit_stat", "failed")
+        }
+    return summary
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.3f}s"
+
+
+def print_summary(summary):
+    print(f"\n{summary['mode']}: {summary['lookups']} lookups at concurrency {summary['concurrency']}, "
+          f"{summary['succeeded']} succeeded, {summary['failed']} failed in {summary['wall_time']:.2f}s")
+    for label, key in (("latency", "latency"), ("  analyze", "analyze_latency"), ("  export", "export_latency")):
+        if key in summary:
+            values = summary[key]
+            print(f"  {label:<10} p50 {format_seconds(values['p50'])}  p95 {format_seconds(values['p95'])}  "
+                  f"p99 {format_seconds(values['p99'])}")
+    print(f"  throughput {summary['lookups_per_second']:.2f} lookups/s")
+    calls = summary.get("upstream_calls_per_lookup")
+    if calls:
+        print(f"  upstream calls per lookup: trigger {calls['trigger']:.2f}, status {calls['status']:.2f}, "
+              f"credit-stat {calls['credit_stat']:.2f} ({calls['failed']:.2f} failed)")
+    for error in summary["errors"]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency and throughput benchmark for PersonaAI")
+    parser.add_argument("--mode", choices=["web", "cli", "both"], default="both", help="Which front end to drive")
+    parser.add_argument("--lookups", type=int, default=DEFAULT_LOOKUPS, help="Lookups per mode")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Lookups in flight at once")
+    parser.add_argument("--irbis-url", help="Use an already running IRBIS (or fake_irbis.py) instead of starting one")
+    parser.add_argument("--app-url", help="Drive a running web app instead of the in-process Flask app")
+    parser.add_argument("--job-poll-interval", type=float, default=DEFAULT_JOB_POLL_INTERVAL,
+                        help="Seconds between /jobs status checks in web mode")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Give up on a lookup after this many seconds")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    irbis_url = args.irbis_url
+    if not irbis_url:
+        server = FakeIrbisServer(port=0, config=config_from_args(args))
+        server.start()
+        irbis_url = server.url
+
+    summaries = []
+    with tempfile.TemporaryDirectory(prefix="personaai-bench-") as workdir:
+        configure_environment(irbis_url, workdir)
+        if args.mode in ("cli", "both"):
+            summaries.append(run_benchmark(
+                "cli", lambda facebook_id: run_cli_lookup(facebook_id, args.timeout),
+                args.lookups, args.concurrency, irbis_url,
+            ))
+        if args.mode in ("web", "both"):
+            web_app = RemoteApp(args.app_url) if args.app_url else InProcessApp()
+            summaries.append(run_benchmark(
+                "web", lambda facebook_id: run_web_lookup(web_app, facebook_id, args.job_poll_interval, args.timeout),
+                args.lookups, args.concurrency, irbis_url,
+            ))
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        for summary in summaries:
+            print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
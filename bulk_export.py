@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.units import inch
+
+from pdf_renderer import build_profile_pdf, get_image_fetcher, TITLE_STYLE, TEXT_STYLE
+from profile_model import LookupResult
+
+# Constants
+IMAGE_PREFETCH_WORKERS = 8
+TOC_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), "Helvetica"),
+    ('FONTSIZE', (0, 0), (-1, -1), 12),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Process pool shared by bulk exports. Workers are spawned rather than forked so
+# they don't inherit the web server's threads and locks.
+def get_render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get("PERSONAAI_RENDER_WORKERS", os.cpu_count() or 1))
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# Worker entry point: lay out one profile with its already fetched image
+def _render(profile, image_bytes):
+    return build_profile_pdf(profile, image_bytes or b"")
+
+
+# Fetch all profile images in parallel in this process (I/O bound, and cached)
+# so the CPU-bound workers never wait on an image host
+def _prefetch_images(profiles):
+    fetcher = get_image_fetcher()
+    with ThreadPoolExecutor(max_workers=IMAGE_PREFETCH_WORKERS) as executor:
+        return list(executor.map(lambda profile: fetcher.fetch(profile.image_url), profiles))
+
+
+# Render each profile to PDF bytes in the process pool, in input order
+def render_all(profiles):
+    images = _prefetch_images(profiles)
+    return list(get_render_pool().map(_render, profiles, images))
+
+
+# Build the table-of-contents pages; entries are (name, first page number)
+def _build_toc(entries):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    rows = [[Paragraph(name, TEXT_STYLE), str(page)] for name, page in entries]
+    table = Table(rows, colWidths=[5.5*inch, 1*inch])
+    table.setStyle(TOC_TABLE_STYLE)
+    doc.build([Paragraph("PersonaAI Report", TITLE_STYLE), Spacer(1, 20), table])
+    return buffer.getvalue()
+
+
+# One PDF holding every profile, preceded by a table of contents and with a bookmark per profile
+def build_combined_pdf(profiles):
+    readers = [PdfReader(BytesIO(pdf)) for pdf in render_all(profiles)]
+    names = [profile.name for profile in profiles]
+
+    # Page numbers depend on how long the TOC itself is, so lay it out until that settles
+    toc_pages = 1
+    while True:
+        entries = []
+        page = toc_pages + 1
+        for name, reader in zip(names, readers):
+            entries.append((name, page))
+            page += len(reader.pages)
+        toc = PdfReader(BytesIO(_build_toc(entries)))
+        if len(toc.pages) == toc_pages:
+            break
+        toc_pages = len(toc.pages)
+
+    writer = PdfWriter()
+    writer.append(toc)
+    for (name, first_page), reader in zip(entries, readers):
+        writer.append(reader)
+        writer.add_outline_item(name, first_page - 1)
+
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+# Collects what zipfile writes so it can be handed out chunk by chunk
+class _ChunkSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# File name for a profile inside the ZIP
+def pdf_file_name(index, profile):
+    slug = re.sub(r'[^A-Za-z0-9._-]+', '_', profile.name).strip('_') or "profile"
+    return f"{index + 1:03d}_{slug[:60]}.pdf"
+
+
+# Stream a ZIP of individual PDFs, yielding each one as soon as its render finishes
+def iter_zip(profiles):
+    images = _prefetch_images(profiles)
+    pool = get_render_pool()
+    futures = {pool.submit(_render, profile, image): index
+               for index, (profile, image) in enumerate(zip(profiles, images))}
+
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for future in as_completed(futures):
+            index = futures[future]
+            archive.writestr(pdf_file_name(index, profiles[index]), future.result())
+            yield sink.drain()
+    yield sink.drain()
+
+
+# Read profiles from batch output (one JSON result per line)
+def read_batch_results(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield LookupResult.from_json(line).profile
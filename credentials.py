@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("personaai.credentials")
+
+# Constants
+API_KEY_FILE = "apikey.txt"
+API_KEYS_FILE = "apikeys.txt"
+KEY_FILE = "secret.key"
+ENV_API_KEY = "PERSONAAI_API_KEY"
+ENV_API_KEYS = "PERSONAAI_API_KEYS"
+ENV_API_KEY_FILE = "PERSONAAI_API_KEY_FILE"
+DEFAULT_CHECK_INTERVAL = 5.0
+
+
+# Loads and decrypts the IRBIS API key once and serves it from memory.
+# Sources, in order: the PERSONAAI_API_KEY environment variable, a plain-text
+# secret file named by PERSONAAI_API_KEY_FILE, then the encrypted apikey.txt.
+# File sources are re-checked by mtime at most every check_interval seconds.
+# Further keys for the key pool come from PERSONAAI_API_KEYS (comma-separated)
+# or the encrypted apikeys.txt; get_api_keys() lists the primary key first.
+class CredentialProvider:
+    def __init__(self, api_key_file=API_KEY_FILE, key_file=KEY_FILE, api_keys_file=API_KEYS_FILE,
+                 check_interval=DEFAULT_CHECK_INTERVAL, environ=None):
+        environ = os.environ if environ is None else environ
+        self.env_api_key = environ.get(ENV_API_KEY) or None
+        env_api_keys = environ.get(ENV_API_KEYS)
+        self.env_api_keys = [key.strip() for key in env_api_keys.split(",") if key.strip()] if env_api_keys else None
+        self.secret_file = environ.get(ENV_API_KEY_FILE) or None
+        self.api_key_file = api_key_file
+        self.api_keys_file = api_keys_file
+        self.key_file = key_file
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self._fernet = None
+        self._api_key = None
+        self._source_mtime = None
+        self._checked_at = None
+        self._pool = []
+        self._pool_mtime = None
+        self._pool_checked_at = None
+
+    @property
+    def source(self):
+        if self.env_api_key:
+            return "env"
+        if self.secret_file:
+            return "secret-file"
+        return "encrypted-file"
+
+    # Return the API key, or None if none is configured
+    def get_api_key(self):
+        if self.env_api_key:
+            return self.env_api_key
+
+        now = time.monotonic()
+        with self.lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._api_key
+            self._checked_at = now
+            path = self.secret_file or self.api_key_file
+            mtime = _mtime(path)
+            if mtime != self._source_mtime:
+                self._source_mtime = mtime
+                self._api_key = self._read_api_key(path) if mtime is not None else None
+            return self._api_key
+
+    def _read_api_key(self, path):
+        with open(path, 'rb') as file:
+            content = file.read()
+        if self.secret_file:
+            return content.decode().strip() or None
+        try:
+            return self._get_fernet().decrypt(content).decode()
+        except Exception as e:
+            logger.warning("Error decrypting API key: %r", e)
+            return None
+
+    # Encrypt and store a new API key, replacing the cached one
+    def store_api_key(self, api_key):
+        with self.lock:
+            encrypted_key = self._get_fernet().encrypt(api_key.encode())
+            with open(self.api_key_file, 'wb') as file:
+                file.write(encrypted_key)
+            self._api_key = api_key
+            self._source_mtime = _mtime(self.api_key_file)
+            self._checked_at = time.monotonic()
+
+    # Every configured key, primary first and without duplicates
+    def get_api_keys(self):
+        primary = self.get_api_key()
+        pool = self.env_api_keys if self.env_api_keys is not None else self._get_pool()
+        return list(dict.fromkeys(([primary] if primary else []) + pool))
+
+    def _get_pool(self):
+        now = time.monotonic()
+        with self.lock:
+            if self._pool_checked_at is not None and now - self._pool_checked_at < self.check_interval:
+                return self._pool
+            self._pool_checked_at = now
+            mtime = _mtime(self.api_keys_file)
+            if mtime != self._pool_mtime:
+                self._pool_mtime = mtime
+                self._pool = self._read_pool() if mtime is not None else []
+            return self._pool
+
+    def _read_pool(self):
+        with open(self.api_keys_file, 'rb') as file:
+            content = file.read()
+        try:
+            return [key for key in self._get_fernet().decrypt(content).decode().splitlines() if key]
+        except Exception as e:
+            logger.warning("Error decrypting API keys: %r", e)
+            return []
+
+    def _write_pool(self, keys):
+        if keys:
+            with open(self.api_keys_file, 'wb') as file:
+                file.write(self._get_fernet().encrypt("\n".join(keys).encode()))
+        elif os.path.exists(self.api_keys_file):
+            os.remove(self.api_keys_file)
+        self._pool = list(keys)
+        self._pool_mtime = _mtime(self.api_keys_file)
+        self._pool_checked_at = time.monotonic()
+
+    # Add a key to the pool, or make it the primary key if there is none yet
+    def add_api_key(self, api_key):
+        primary = self.get_api_key()
+        if not primary:
+            self.store_api_key(api_key)
+            return
+        pool = self._get_pool()
+        with self.lock:
+            if api_key != primary and api_key not in pool:
+                self._write_pool(pool + [api_key])
+
+    # Remove a stored key; removing the primary key promotes the first pool key.
+    # Keys from the environment can't be removed here, so False is returned for them.
+    def remove_api_key(self, api_key):
+        if api_key == self.env_api_key or (self.env_api_keys and api_key in self.env_api_keys):
+            return False
+        pool = self._get_pool()
+        if api_key in pool:
+            with self.lock:
+                self._write_pool([key for key in pool if key != api_key])
+            return True
+        if api_key != self.get_api_key() or self.secret_file:
+            return False
+        if pool:
+            self.store_api_key(pool[0])
+            with self.lock:
+                self._write_pool(pool[1:])
+        else:
+            with self.lock:
+                if os.path.exists(self.api_key_file):
+                    os.remove(self.api_key_file)
+                self._api_key = None
+                self._source_mtime = None
+                self._checked_at = time.monotonic()
+        return True
+
+    # Forget everything cached so the next call reloads from the sources
+    def invalidate(self):
+        with self.lock:
+            self._fernet = None
+            self._api_key = None
+            self._source_mtime = None
+            self._checked_at = None
+            self._pool = []
+            self._pool_mtime = None
+            self._pool_checked_at = None
+
+    def encrypt(self, message):
+        with self.lock:
+            return self._get_fernet().encrypt(message.encode())
+
+    def decrypt(self, token):
+        with self.lock:
+            return self._get_fernet().decrypt(token).decode()
+
+    # Fernet for the key in key_file, generating the key file on first use.
+    # cryptography is imported here so keys from the environment never load it.
+    def _get_fernet(self):
+        if self._fernet is None:
+            from cryptography.fernet import Fernet
+            if not os.path.exists(self.key_file):
+                key = Fernet.generate_key()
+                with open(self.key_file, 'wb') as key_file:
+                    key_file.write(key)
+            else:
+                with open(self.key_file, 'rb') as key_file:
+                    key = key_file.read()
+            self._fernet = Fernet(key)
+        return self._fernet
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+_default_provider = None
+
+
+# Shared provider for the CLI and the web app
+def get_credentials():
+    global _default_provider
+    if _default_provider is None:
+        _default_provider = CredentialProvider()
+    return _default_provider
@@ -0,0 +1,89 @@
+import re
+from urllib.parse import parse_qs
+
+# Patterns, compiled once
+# Numeric ID (e.g., "100077649716158")
+NUMERIC_ID_PATTERN = re.compile(r'^\d+$')
+# Alphanumeric username with periods (e.g., "itaybar1", "eloy.simoesjr", "gwry.pwmrny.n.l.ymwz.whhzrh")
+USERNAME_PATTERN = re.compile(r'^[a-zA-Z0-9._-]+$')
+# Numeric ID at the end of a path segment (e.g., "100077649716158" or "Some-Name-100077649716158")
+TRAILING_ID_PATTERN = re.compile(r'(?:^|-)(\d+)$')
+# facebook.com / fb.com links, with or without scheme and subdomain (www., m., web., ...)
+PROFILE_URL_PATTERN = re.compile(
+    r'^(?:https?://)?(?:[a-z0-9-]+\.)*(?:facebook\.com|fb\.com)(?::\d+)?'
+    r'(?P<path>/[^?#]*)?(?:\?(?P<query>[^#]*))?(?:#.*)?$',
+    re.IGNORECASE,
+)
+
+# First path segments that are site sections rather than usernames
+RESERVED_PATHS = frozenset([
+    "events", "friends", "gaming", "groups", "hashtag", "help", "login", "marketplace", "messages",
+    "pg", "photos", "policies", "posts", "reel", "reels", "search", "settings", "share", "sharer",
+    "stories", "story", "videos", "watch",
+])
+
+
+# Canonical form of a Facebook ID, username or profile link, or None if it isn't one.
+# Usernames are case-insensitive on Facebook, so they are lowercased.
+def normalize_facebook_id(value):
+    value = value.strip()
+    if value.startswith("@"):
+        value = value[1:]
+    if NUMERIC_ID_PATTERN.match(value):
+        return value
+
+    match = PROFILE_URL_PATTERN.match(value)
+    if match:
+        return _id_from_url(match.group('path') or "", match.group('query') or "")
+
+    if USERNAME_PATTERN.match(value):
+        return value.lower()
+    return None
+
+
+def _id_from_url(path, query):
+    segments = [segment for segment in path.split("/") if segment]
+    if not segments:
+        return None
+    first = segments[0].lower()
+
+    # facebook.com/profile.php?id=100077649716158
+    if first == "profile.php":
+        ids = parse_qs(query).get("id") or []
+        return ids[0] if ids and NUMERIC_ID_PATTERN.match(ids[0]) else None
+    # facebook.com/people/Some-Name/100077649716158, /pages/Some-Name/123... and /p/Some-Name-123.../
+    if first in ("people", "pages", "p"):
+        for segment in reversed(segments[1:]):
+            match = TRAILING_ID_PATTERN.search(segment)
+            if match:
+                return match.group(1)
+        return None
+    # Scripts (l.php, photo.php, story.php, ...) are never profiles
+    if first in RESERVED_PATHS or first.endswith(".php") or not USERNAME_PATTERN.match(segments[0]):
+        return None
+    # facebook.com/username or facebook.com/username/about
+    return normalize_facebook_id(segments[0])
+
+
+def validate_facebook_id(value):
+    return normalize_facebook_id(value) is not None
+
+
+# Canonical IDs from lines of input, in order, in one streaming pass: blanks and
+# comments are skipped, invalid rows reported through on_invalid(line) and
+# duplicates (including the same profile written differently) dropped
+def read_ids(lines, on_invalid=None):
+    seen = set()
+    for line in lines:
+        value = line.strip()
+        if not value or value.startswith("#"):
+            continue
+        facebook_id = normalize_facebook_id(value)
+        if facebook_id is None:
+            if on_invalid:
+                on_invalid(value)
+            continue
+        if facebook_id in seen:
+            continue
+        seen.add(facebook_id)
+        yield facebook_id
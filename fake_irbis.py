@@ -0,0 +1,273 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Constants
+# Same endpoints as irbis_client.py. Not imported from there: irbis_client reads
+# IRBIS_BASE_URL at import time, and the benchmark sets it after starting this server.
+PSYCHO_PROFILE_PATH = "/api/developer/psycho_profile"
+RESULTS_PATH_TEMPLATE = "/api/request-monitor/api-usage/{}"
+CREDIT_STAT_PATH = "/api/request-monitor/credit-stat"
+DEFAULT_PORT = 8765
+DEFAULT_DELAY = 5.0
+DEFAULT_CREDITS = 1000
+DEFAULT_RETRY_AFTER = 1
+RESULTS_PREFIX = RESULTS_PATH_TEMPLATE.format("")
+STATS_PATH = "/__stats"
+RESET_PATH = "/__reset"
+INVALID_API_KEY = "invalid"
+EMPTY_PROFILE_PREFIX = "empty"
+
+
+# Behaviour of the stand-in server
+class FakeIrbisConfig:
+    def __init__(self, delay=DEFAULT_DELAY, jitter=0.0, ready_lag=0.0, failure_rate=0.0,
+                 empty_rate=0.0, credits=DEFAULT_CREDITS, seed=None, throttle_rate=0.0,
+                 retry_after=DEFAULT_RETRY_AFTER):
+        self.delay = delay  # seconds until a lookup reports FINISHED
+        self.jitter = jitter  # +/- random seconds added to delay
+        self.ready_lag = ready_lag  # seconds FINISHED is reported before the profile is attached
+        self.failure_rate = failure_rate  # share of requests answered with a 503
+        self.throttle_rate = throttle_rate  # share of requests answered with a 429
+        self.retry_after = retry_after  # Retry-After seconds sent with a 429
+        self.empty_rate = empty_rate  # share of lookups that turn out empty
+        self.credits = credits
+        self.random = random.Random(seed)
+
+
+# In-memory IRBIS stand-in: triggers lookups, reports them pending until their
+# processing delay has passed and counts every call it serves
+class FakeIrbisState:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1000)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.lookups = {}
+            self.credits = self.config.credits
+            self.calls = {"trigger": 0, "status": 0, "credit_stat": 0, "failed": 0, "throttled": 0}
+
+    def count(self, kind):
+        with self.lock:
+            self.calls[kind] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.calls, credits=self.credits, lookups=len(self.lookups))
+
+    # Randomly fail a request with a 503, as configured
+    def should_fail(self):
+        with self.lock:
+            failed = self.config.random.random() < self.config.failure_rate
+            if failed:
+                self.calls["failed"] += 1
+            return failed
+
+    # Randomly throttle a request with a 429, as configured
+    def should_throttle(self):
+        with self.lock:
+            throttled = self.config.random.random() < self.config.throttle_rate
+            if throttled:
+                self.calls["throttled"] += 1
+            return throttled
+
+    def trigger(self, value):
+        config = self.config
+        with self.lock:
+            if self.credits <= 0:
+                return None
+            self.credits -= 1
+            lookup_id = next(self.ids)
+            delay = max(0.0, config.delay + config.random.uniform(-config.jitter, config.jitter))
+            empty = value.startswith(EMPTY_PROFILE_PREFIX) or config.random.random() < config.empty_rate
+            self.lookups[lookup_id] = {"value": value, "ready_at": time.monotonic() + delay, "empty": empty}
+            return lookup_id
+
+    # Response body for a status check, or None for an unknown lookup
+    def status(self, lookup_id):
+        with self.lock:
+            lookup = self.lookups.get(lookup_id)
+        if lookup is None:
+            return None
+        now = time.monotonic()
+        if now < lookup["ready_at"]:
+            return {"data": [{"status": "PROGRESS"}]}
+        if lookup["empty"]:
+            return {"status": "finished", "data": []}
+        if now < lookup["ready_at"] + self.config.ready_lag:
+            return {"data": [{"status": "FINISHED", "psychAnalyst": {"profiles": []}}]}
+        return {"data": [{"status": "FINISHED", "psychAnalyst": fake_profile(lookup["value"])}]}
+
+    def account_info(self):
+        with self.lock:
+            credits = self.credits
+        return {
+            "balance": credits / 10,
+            "currency": "USD",
+            "credits": credits,
+            "expiratioDate": "2099-01-01T00:00:00.000Z",
+            "status": "ACTIVE",
+        }
+
+
+# Profile payload shaped like a real IRBIS psychAnalyst block
+def fake_profile(value):
+    return {
+        "image": "",
+        "profiles": [{
+            "personName": f"Test Person {value}",
+            "psychologicalPortrait": f"Synthetic portrait generated for {value} by the local IRBIS stand-in.",
+            "levelOfDanger": "Low, no concerning patterns in the synthetic data",
+            "predictedCharacteristics": ["Curious", "Organised", "Sociable"],
+        }],
+    }
+
+
+class FakeIrbisHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status_code, body, headers=None):
+        encoded = json.dumps(body).encode()
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def send_throttled(self):
+        self.send_json(429, {"message": "Too many requests"},
+                       {"Retry-After": str(self.server.state.config.retry_after)})
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        api_key = parse_qs(url.query).get("key", [""])[0]
+        if url.path == STATS_PATH:
+            return self.send_json(200, state.stats())
+
+        if url.path == CREDIT_STAT_PATH:
+            state.count("credit_stat")
+            if state.should_fail():
+                return self.send_json(503, {"message": "Service unavailable"})
+            if not api_key or api_key == INVALID_API_KEY:
+                return self.send_json(401, {"message": "Invalid API key"})
+            return self.send_json(200, state.account_info())
+
+        if url.path.startswith(RESULTS_PREFIX):
+            state.count("status")
+            if state.should_fail():
+                return self.send_json(503, {"message": "Service unavailable"})
+            if state.should_throttle():
+                return self.send_throttled()
+            try:
+                lookup_id = int(url.path[len(RESULTS_PREFIX):])
+            except ValueError:
+                return self.send_json(404, {"message": "Not found"})
+            body = state.status(lookup_id)
+            if body is None:
+                return self.send_json(404, {"message": "Not found"})
+            return self.send_json(200, body)
+
+        self.send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        url = urlparse(self.path)
+        if url.path == RESET_PATH:
+            state.reset()
+            return self.send_json(200, state.stats())
+        if url.path != PSYCHO_PROFILE_PATH:
+            return self.send_json(404, {"message": "Not found"})
+
+        state.count("trigger")
+        if state.should_fail():
+            return self.send_json(503, {"message": "Service unavailable"})
+        if state.should_throttle():
+            return self.send_throttled()
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self.send_json(400, {"message": "Invalid JSON"})
+        if not payload.get("key") or payload.get("key") == INVALID_API_KEY:
+            return self.send_json(401, {"message": "Invalid API key"})
+        if not payload.get("value"):
+            return self.send_json(400, {"message": "Missing value"})
+        lookup_id = state.trigger(payload["value"])
+        if lookup_id is None:
+            return self.send_json(402, {"message": "Not enough credits"})
+        self.send_json(201, {"id": lookup_id})
+
+
+class FakeIrbisServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, config=None):
+        super().__init__((host, port), FakeIrbisHandler)
+        self.state = FakeIrbisState(config or FakeIrbisConfig())
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # Serve from a daemon thread; returns the thread
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="fake-irbis", daemon=True)
+        thread.start()
+        return thread
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY, help="Seconds until a lookup finishes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to --delay")
+    parser.add_argument("--ready-lag", type=float, default=0.0, help="Seconds a lookup reports FINISHED before its profile is attached")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with a 503 (0-1)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with a 429 (0-1)")
+    parser.add_argument("--retry-after", type=float, default=DEFAULT_RETRY_AFTER, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="Share of lookups that come back empty (0-1)")
+    parser.add_argument("--credits", type=int, default=DEFAULT_CREDITS, help="Credits on the fake account")
+    parser.add_argument("--seed", type=int, help="Random seed for repeatable runs")
+
+
+def config_from_args(args):
+    return FakeIrbisConfig(
+        delay=args.delay, jitter=args.jitter, ready_lag=args.ready_lag, failure_rate=args.failure_rate,
+        empty_rate=args.empty_rate, credits=args.credits, seed=args.seed, throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local IRBIS stand-in for testing and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeIrbisServer(args.host, args.port, config_from_args(args))
+    print(f"Fake IRBIS listening on {server.url} (set IRBIS_BASE_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger("personaai.images")
+
+# Constants
+DEFAULT_IMAGE_CACHE_DIR = "image_cache"
+DEFAULT_IMAGE_CACHE_MAX_BYTES = 100 * 1024 * 1024
+EVICT_TO = 0.9  # fraction of max_bytes left after an eviction pass
+FILE_SUFFIX = ".jpg"
+
+
+# Bounded on-disk cache of profile thumbnails, one file per image URL. A read
+# bumps the file's mtime, and once the directory grows past max_bytes the least
+# recently used files are deleted. The directory is rescanned on eviction, so
+# several processes (gunicorn workers, the CLI) can share it.
+class DiskImageCache:
+    def __init__(self, directory=DEFAULT_IMAGE_CACHE_DIR, max_bytes=DEFAULT_IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._scan())
+
+    # Cached thumbnail bytes for url, or None
+    def get(self, url):
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return content
+
+    def put(self, url, content):
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            # Replacing an existing file only adds the difference in size
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Error saving cached image: %s", e)
+            return
+        with self.lock:
+            self.total_bytes += len(content) - replaced
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                self._evict()
+
+    # Delete least recently used files until the directory is back under EVICT_TO of max_bytes
+    def _evict(self):
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # another process got there first
+            total -= size
+        self.total_bytes = total
+
+    # (path, size, mtime) for every cached image
+    def _scan(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(FILE_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + FILE_SUFFIX)
+
+    def __len__(self):
+        return len(self._scan())
+
+
+# Shared cache from PERSONAAI_IMAGE_CACHE_DIR / PERSONAAI_IMAGE_CACHE_MAX_BYTES; an empty directory turns it off
+def image_cache_from_env():
+    directory = os.environ.get("PERSONAAI_IMAGE_CACHE_DIR", DEFAULT_IMAGE_CACHE_DIR)
+    if not directory:
+        return None
+    try:
+        return DiskImageCache(
+            directory, int(os.environ.get("PERSONAAI_IMAGE_CACHE_MAX_BYTES", DEFAULT_IMAGE_CACHE_MAX_BYTES)))
+    except OSError as e:
+        logger.warning("Image disk cache disabled: %s", e)
+        return None
@@ -0,0 +1,155 @@
+import logging
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import TRIGGER_SECONDS, STATUS_CHECK_SECONDS
+
+logger = logging.getLogger("personaai.irbis")
+
+# Constants
+IRBIS_BASE_URL = os.environ.get("IRBIS_BASE_URL", "https://irbis.espysys.com").rstrip("/")
+PSYCHO_PROFILE_PATH = "/api/developer/psycho_profile"
+RESULTS_PATH_TEMPLATE = "/api/request-monitor/api-usage/{}"
+CREDIT_STAT_PATH = "/api/request-monitor/credit-stat"
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Lookup states reported by lookup_state()
+LOOKUP_PENDING = "pending"
+LOOKUP_EMPTY = "empty"
+LOOKUP_FINISHED = "finished"
+
+
+# Base error for failed IRBIS lookups
+class IrbisError(Exception):
+    pass
+
+
+# IRBIS answered 404 for a lookup ID
+class LookupNotFoundError(IrbisError):
+    pass
+
+
+# IRBIS kept reporting "finished" with no data: the profile is empty or missing
+class EmptyProfileError(IrbisError):
+    pass
+
+
+# Classify a lookup status response as pending, empty or finished
+def lookup_state(data):
+    records = data.get('data')
+    if records is None:
+        return LOOKUP_PENDING, None
+    if len(records) == 0:
+        if data.get('status') == "finished":
+            return LOOKUP_EMPTY, None
+        return LOOKUP_PENDING, None
+    if records[0].get('status') == "FINISHED":
+        return LOOKUP_FINISHED, records[0]
+    return LOOKUP_PENDING, records[0]
+
+
+# True once a finished record carries its psychAnalyst profiles
+def profile_ready(record):
+    return bool(record and (record.get('psychAnalyst') or {}).get('profiles'))
+
+
+# Client holding one pooled keep-alive session to the IRBIS API
+class IrbisClient:
+    def __init__(self, base_url=IRBIS_BASE_URL, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.latency_hooks = []
+
+        # POST is left out of allowed_methods on purpose: a trigger that reached
+        # the server costs credits, so only connection failures are retried for it.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(JSON_HEADERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def results_url(self, lookup_id):
+        return self.url(RESULTS_PATH_TEMPLATE.format(lookup_id))
+
+    # Register a callback(method, path, status_code, seconds) run after every request
+    def add_latency_hook(self, hook):
+        self.latency_hooks.append(hook)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        status_code = None
+        try:
+            response = self.session.request(method, self.url(path), **kwargs)
+            status_code = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            logger.debug("%s %s -> %s in %.3fs", method, path, status_code, elapsed)
+            for hook in self.latency_hooks:
+                hook(method, path, status_code, elapsed)
+
+    # Fetch the account credit statistics for an API key
+    def credit_stat(self, api_key):
+        return self.request("GET", CREDIT_STAT_PATH, params={"key": api_key})
+
+    # Start a psycho profile lookup for a Facebook ID
+    def trigger_psycho_profile(self, api_key, facebook_id):
+        payload = {
+            "key": api_key,
+            "lookupType": "PSYCH",
+            "value": facebook_id,
+            "lookupId": 180
+        }
+        with TRIGGER_SECONDS.time():
+            return self.request("POST", PSYCHO_PROFILE_PATH, json=payload)
+
+    # Fetch the current state of a lookup
+    def lookup_status(self, api_key, lookup_id):
+        with STATUS_CHECK_SECONDS.time():
+            return self.request("GET", RESULTS_PATH_TEMPLATE.format(lookup_id), params={"key": api_key})
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+
+
+# Shared client used by both the CLI and the web app
+def get_client():
+    global _default_client
+    if _default_client is None:
+        _default_client = IrbisClient(
+            pool_size=int(os.environ.get("IRBIS_POOL_SIZE", DEFAULT_POOL_SIZE)),
+            connect_timeout=float(os.environ.get("IRBIS_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+            read_timeout=float(os.environ.get("IRBIS_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+            retries=int(os.environ.get("IRBIS_RETRIES", DEFAULT_RETRIES)),
+        )
+    return _default_client
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import ADMISSION_WAITING
+
+logger = logging.getLogger("personaai.jobs")
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_JOBS = 1000
+MAX_JOB_EVENTS = 200
+
+
+# Raised by a job function to fail the job with a user-facing message
+class AnalysisError(Exception):
+    pass
+
+
+# A single background analysis and its progress. Every update is also kept as a
+# numbered lifecycle event (queued, triggered, poll, rendered, finished, ...) and
+# pushed to subscribers, which is what the progress stream serves.
+class Job:
+    def __init__(self, facebook_id):
+        self.id = uuid.uuid4().hex
+        self.facebook_id = facebook_id
+        self.status = QUEUED
+        self.message = "Waiting for a free worker..."
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=MAX_JOB_EVENTS)
+        self.last_event_id = 0
+        self.listeners = []
+        self._record_event("queued", {})
+
+    @property
+    def done(self):
+        return self.status in (FINISHED, FAILED)
+
+    # Change status and/or message; event names the lifecycle step (defaults to the
+    # new status, or "progress") and data is attached to it
+    def update(self, status=None, message=None, event=None, **data):
+        with self.lock:
+            if status is not None:
+                self.status = status
+            if message is not None:
+                self.message = message
+            self.updated_at = time.time()
+            entry = self._record_event(event or status or "progress", data)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(entry)
+            except Exception as e:
+                logger.warning("Event listener failed for job %s: %s", self.id, e)
+
+    def _record_event(self, name, data):
+        self.last_event_id += 1
+        entry = dict(data, id=self.last_event_id, event=name, status=self.status,
+                     message=self.message, time=self.updated_at)
+        self.events.append(entry)
+        return entry
+
+    # Call listener(event) for every future event; returns (events so far, unsubscribe)
+    def subscribe(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            backlog = list(self.events)
+
+        def unsubscribe():
+            with self.lock:
+                if listener in self.listeners:
+                    self.listeners.remove(listener)
+
+        return backlog, unsubscribe
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "facebook_id": self.facebook_id,
+            "status": self.status,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+# Runs analyses on a worker pool and keeps the most recent jobs addressable by ID
+class JobQueue:
+    def __init__(self, workers=DEFAULT_WORKERS, max_jobs=DEFAULT_MAX_JOBS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="personaai-job")
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Queue fn(job, *args) and return the job right away. fn returns the job result,
+    # or a Future for it so the worker is freed while the lookup is still polling.
+    # on_done(job) is called once the job's outcome is known, just before it is announced.
+    def submit(self, facebook_id, fn, *args, on_done=None):
+        job = Job(facebook_id)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._evict()
+        ADMISSION_WAITING.inc()
+        self.executor.submit(self._run, job, fn, args, on_done)
+        return job
+
+    # Register a job whose result is already known (e.g. served from the cache)
+    def complete(self, facebook_id, result):
+        job = Job(facebook_id)
+        job.result = result
+        job.update(FINISHED, "Analysis complete.")
+        with self.lock:
+            self.jobs[job.id] = job
+            self._evict()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, fn, args, on_done):
+        ADMISSION_WAITING.dec()
+        job.update(RUNNING, "Starting analysis...")
+        try:
+            result = fn(job, *args)
+        except Exception as e:
+            self._fail(job, e, on_done)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._complete(job, future, on_done))
+        else:
+            self._finish(job, result, on_done)
+
+    def _complete(self, job, future, on_done):
+        try:
+            result = future.result()
+        except Exception as e:
+            self._fail(job, e, on_done)
+            return
+        self._finish(job, result, on_done)
+
+    def _finish(self, job, result, on_done=None):
+        job.result = result
+        _call_on_done(on_done, job)
+        job.update(FINISHED, "Analysis complete.")
+
+    def _fail(self, job, e, on_done=None):
+        if isinstance(e, AnalysisError):
+            job.error = str(e)
+        else:
+            logger.error("Job %s failed: %s", job.id, e)
+            job.error = "Profile analysis failed. Please try again later."
+        _call_on_done(on_done, job)
+        job.update(FAILED, job.error)
+
+    # Drop the oldest finished jobs once over capacity
+    def _evict(self):
+        if len(self.jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done]:
+            del self.jobs[job_id]
+            if len(self.jobs) <= self.max_jobs:
+                break
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
+
+
+def _call_on_done(on_done, job):
+    if on_done is None:
+        return
+    try:
+        on_done(job)
+    except Exception as e:
+        logger.warning("Completion callback failed for job %s: %s", job.id, e)
+
+
+# Return a Future resolving to fn(future.result()). Exceptions propagate, passed
+# through on_error(exception) first when given so they can be translated. With an
+# executor, fn runs there instead of on the thread that resolved future (e.g. the
+# poller's event loop, which must not block on storage writes).
+def then(future, fn, on_error=None, executor=None):
+    chained = Future()
+
+    def settle(done):
+        try:
+            chained.set_result(fn(done.result()))
+        except Exception as e:
+            chained.set_exception(on_error(e) if on_error else e)
+
+    if executor is None:
+        future.add_done_callback(settle)
+    else:
+        future.add_done_callback(lambda done: executor.submit(settle, done))
+    return chained
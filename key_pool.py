@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Constants
+ERROR_WINDOW = 60.0  # seconds of responses that count towards a key's error rate
+ERROR_WEIGHT = 10  # one key with every recent call failing ranks like 10 extra lookups in flight
+MAX_RESPONSES_PER_KEY = 100
+MAX_REMEMBERED_LOOKUPS = 10000
+
+
+# A key's recent upstream history: lookups in flight, responses in the last
+# ERROR_WINDOW seconds and any pause requested by a 429
+class KeyStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.responses = deque(maxlen=MAX_RESPONSES_PER_KEY)  # (time, failed)
+        self.paused_until = 0.0
+
+    def error_rate(self, now):
+        while self.responses and now - self.responses[0][0] > ERROR_WINDOW:
+            self.responses.popleft()
+        if not self.responses:
+            return 0.0
+        return sum(1 for _, failed in self.responses if failed) / len(self.responses)
+
+
+# Spreads lookups over several IRBIS API keys. Each trigger goes to the key with
+# the fewest lookups in flight, weighted by its recent error and throttle rate,
+# preferring keys with more known credits; keys without credits or paused by a
+# 429 are skipped while others are available. Lookups are pinned to the key that
+# triggered them, because IRBIS only answers status checks for the owning key.
+class KeyRouter:
+    def __init__(self, credits):
+        self.credits = credits  # scheduler.CreditTracker
+        self.stats = {}
+        self.owners = OrderedDict()  # lookup ID -> API key
+        self.lock = threading.Lock()
+
+    # Pick the key to trigger the next lookup with and count it as in flight at once,
+    # so concurrent callers spread out; None if no key has credits left
+    def acquire(self, api_keys):
+        # Balances may need a credit-stat call, so read them before taking the lock
+        balances = [(api_key, self.credits.remaining(api_key)) for api_key in dict.fromkeys(api_keys)]
+        now = time.monotonic()
+        with self.lock:
+            candidates = []
+            for api_key, remaining in balances:
+                if remaining is not None and remaining < self.credits.credits_per_lookup:
+                    continue
+                stats = self._stats(api_key)
+                load = stats.in_flight + ERROR_WEIGHT * stats.error_rate(now)
+                candidates.append((stats.paused_until > now, load, -(remaining or 0), api_key))
+            if not candidates:
+                return None
+            api_key = min(candidates)[-1]
+            self._stats(api_key).in_flight += 1
+            return api_key
+
+    # Count a lookup that was not started through acquire() (a resumed or joined one)
+    def begin(self, api_key, lookup_id=None):
+        with self.lock:
+            self._stats(api_key).in_flight += 1
+        if lookup_id is not None:
+            self.remember(lookup_id, api_key)
+
+    def finish(self, api_key):
+        with self.lock:
+            stats = self._stats(api_key)
+            stats.in_flight = max(0, stats.in_flight - 1)
+
+    # Record an upstream status code for api_key; 429s and 5xx count as errors
+    def note_response(self, api_key, status_code, pause=None):
+        failed = status_code is None or status_code == 429 or status_code >= 500
+        now = time.monotonic()
+        with self.lock:
+            stats = self._stats(api_key)
+            stats.responses.append((now, failed))
+            if status_code == 429 and pause:
+                stats.paused_until = max(stats.paused_until, now + pause)
+
+    def remember(self, lookup_id, api_key):
+        with self.lock:
+            self.owners[str(lookup_id)] = api_key
+            self.owners.move_to_end(str(lookup_id))
+            while len(self.owners) > MAX_REMEMBERED_LOOKUPS:
+                self.owners.popitem(last=False)
+
+    # The key that triggered lookup_id in this process, or None
+    def owner(self, lookup_id):
+        with self.lock:
+            return self.owners.get(str(lookup_id))
+
+    # [{key (masked), in_flight, error_rate, paused, credits}, ...] in api_keys order, for display
+    def snapshot(self, api_keys):
+        now = time.monotonic()
+        result = []
+        for api_key in api_keys:
+            with self.lock:
+                stats = self._stats(api_key)
+                entry = {"key": mask_key(api_key), "in_flight": stats.in_flight,
+                         "error_rate": round(stats.error_rate(now), 3), "paused": stats.paused_until > now}
+            account = self.credits.accounts.get(api_key)
+            entry["credits"] = account["credits"] if account else None
+            result.append(entry)
+        return result
+
+    def _stats(self, api_key):
+        stats = self.stats.get(api_key)
+        if stats is None:
+            stats = self.stats[api_key] = KeyStats()
+        return stats
+
+
+# An API key for display: all but the last five characters hidden
+def mask_key(api_key):
+    if not api_key:
+        return ""
+    return f"${'*' * (len(api_key) - 5)}{api_key[-5:]}"
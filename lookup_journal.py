@@ -0,0 +1,215 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("personaai.journal")
+
+# Constants
+DEFAULT_JOURNAL_PATH = "lookup_journal.db"
+DEFAULT_RESUME_WINDOW = 24 * 3600  # older unfinished lookups are not resumed
+DEFAULT_RETENTION = 7 * 24 * 3600
+DEFAULT_MAX_ATTEMPTS = 3  # times a lookup is polled until it gives up before it is no longer resumed
+DEFAULT_RESUME_CLAIM = 300  # seconds a process's startup resume keeps others from resuming too
+
+# Journal states
+TRIGGERED = "triggered"
+DONE = "done"
+FAILED = "failed"  # a final answer from IRBIS (empty profile, unknown lookup)
+GAVE_UP = "gave_up"  # polling timed out or kept erroring; resumable until DEFAULT_MAX_ATTEMPTS
+
+
+# Append-only record of every paid-for lookup, in a SQLite file in WAL mode: a
+# "triggered" entry is written as soon as IRBIS returns the lookup ID, and a
+# "done" or "failed" entry once polling gets a final answer. A lookup with no
+# final entry is still outstanding, so an interrupted CLI run, a recycled
+# gunicorn worker or a stopped batch can poll it again instead of paying for a
+# new one. A poll that times out or keeps erroring writes a "gave_up" entry: the
+# lookup stays resumable, but only until it has given up max_attempts times, so a
+# lookup IRBIS has lost doesn't block new ones for good.
+# API keys are stored as SHA-256 digests, never in clear text.
+class LookupJournal:
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, resume_window=DEFAULT_RESUME_WINDOW, retention=DEFAULT_RETENTION,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.resume_window = resume_window
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                lookup_id TEXT NOT NULL,
+                value TEXT NOT NULL,
+                key_digest TEXT NOT NULL,
+                state TEXT NOT NULL,
+                recorded_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lookup_id ON entries (lookup_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_value ON entries (value)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS resume_claim (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                claimed_at REAL NOT NULL
+            )
+        """)
+        self.prune()
+
+    def record_trigger(self, value, lookup_id, api_key):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO entries (lookup_id, value, key_digest, state, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (str(lookup_id), value, _key_digest(api_key), TRIGGERED, time.time()),
+            )
+
+    # Close a lookup with DONE or FAILED, or note a GAVE_UP attempt; unknown lookup IDs are ignored
+    def record_outcome(self, lookup_id, state):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO entries (lookup_id, value, key_digest, state, recorded_at) "
+                "SELECT lookup_id, value, key_digest, ?, ? FROM entries "
+                "WHERE lookup_id = ? AND state = ? ORDER BY seq DESC LIMIT 1",
+                (state, time.time(), str(lookup_id), TRIGGERED),
+            )
+
+    # [(value, lookup_id, api_key), ...] still outstanding for any of api_keys, oldest first
+    def unfinished(self, api_keys, value=None):
+        keys = {_key_digest(api_key): api_key for api_key in api_keys}
+        if not keys:
+            return []
+        query = (
+            "SELECT t.value, t.lookup_id, t.key_digest FROM entries t "
+            f"WHERE t.state = ? AND t.key_digest IN ({', '.join('?' * len(keys))}) AND t.recorded_at >= ? "
+            "AND NOT EXISTS (SELECT 1 FROM entries o WHERE o.lookup_id = t.lookup_id AND o.state IN (?, ?)) "
+            "AND (SELECT COUNT(*) FROM entries g WHERE g.lookup_id = t.lookup_id AND g.state = ?) < ?"
+        )
+        params = [TRIGGERED, *keys, time.time() - self.resume_window, DONE, FAILED, GAVE_UP, self.max_attempts]
+        if value is not None:
+            query += " AND t.value = ?"
+            params.append(value)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY t.seq", params).fetchall()
+        return [(value, lookup_id, keys[key_digest]) for value, lookup_id, key_digest in rows]
+
+    # (lookup_id, api_key) of the newest outstanding lookup for value, or None
+    def unfinished_lookup(self, value, api_keys):
+        rows = self.unfinished(api_keys, value)
+        return rows[-1][1:] if rows else None
+
+    # Which of api_keys triggered lookup_id, or None if it isn't journaled
+    def lookup_key(self, lookup_id, api_keys):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT key_digest FROM entries WHERE lookup_id = ? AND state = ? ORDER BY seq DESC LIMIT 1",
+                (str(lookup_id), TRIGGERED),
+            ).fetchone()
+        if row is None:
+            return None
+        return next((api_key for api_key in api_keys if _key_digest(api_key) == row[0]), None)
+
+    # Claim the startup resume of outstanding lookups. Processes started together
+    # (gunicorn workers, the debug reloader) share the journal, and only the first
+    # within `hold` seconds gets True, so each open lookup is resumed once.
+    def claim_resume(self, hold=DEFAULT_RESUME_CLAIM):
+        now = time.time()
+        with self.lock:
+            return bool(self.conn.execute(
+                "INSERT INTO resume_claim (id, claimed_at) VALUES (1, ?) "
+                "ON CONFLICT (id) DO UPDATE SET claimed_at = excluded.claimed_at WHERE claimed_at < ?",
+                (now, now - hold),
+            ).rowcount)
+
+    # Forget lookups triggered more than `retention` seconds ago
+    def prune(self):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM entries WHERE lookup_id IN "
+                "(SELECT lookup_id FROM entries WHERE state = ? AND recorded_at < ?)",
+                (TRIGGERED, time.time() - self.retention),
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def _key_digest(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+_default_journal = None
+_default_journal_lock = threading.Lock()
+
+
+# Shared journal from PERSONAAI_JOURNAL_PATH (empty turns it off) and PERSONAAI_JOURNAL_RESUME_WINDOW
+def get_lookup_journal():
+    global _default_journal
+    path = os.environ.get("PERSONAAI_JOURNAL_PATH", DEFAULT_JOURNAL_PATH)
+    if not path:
+        return None
+    with _default_journal_lock:
+        if _default_journal is None:
+            _default_journal = LookupJournal(
+                path, resume_window=float(os.environ.get("PERSONAAI_JOURNAL_RESUME_WINDOW", DEFAULT_RESUME_WINDOW)))
+    return _default_journal
+
+
+# Journal helpers for the lookup paths. A journal that can't be written must never
+# fail a lookup that has already been paid for, so errors are only logged.
+def record_trigger(value, lookup_id, api_key):
+    try:
+        journal = get_lookup_journal()
+        if journal is not None:
+            journal.record_trigger(value, lookup_id, api_key)
+    except sqlite3.Error as e:
+        logger.warning("Could not journal lookup %s: %s", lookup_id, e)
+
+
+def record_outcome(lookup_id, state):
+    try:
+        journal = get_lookup_journal()
+        if journal is not None:
+            journal.record_outcome(lookup_id, state)
+    except sqlite3.Error as e:
+        logger.warning("Could not journal the outcome of lookup %s: %s", lookup_id, e)
+
+
+# (lookup_id, api_key) of an outstanding lookup for value that can be polled instead of triggering a new one
+def unfinished_lookup(value, api_keys):
+    try:
+        journal = get_lookup_journal()
+        return journal.unfinished_lookup(value, api_keys) if journal is not None else None
+    except sqlite3.Error as e:
+        logger.warning("Could not read the lookup journal: %s", e)
+        return None
+
+
+def unfinished_lookups(api_keys):
+    try:
+        journal = get_lookup_journal()
+        return journal.unfinished(api_keys) if journal is not None else []
+    except sqlite3.Error as e:
+        logger.warning("Could not read the lookup journal: %s", e)
+        return []
+
+
+def claim_resume():
+    try:
+        journal = get_lookup_journal()
+        return journal.claim_resume() if journal is not None else False
+    except sqlite3.Error as e:
+        logger.warning("Could not read the lookup journal: %s", e)
+        return False
+
+
+def lookup_key(lookup_id, api_keys):
+    try:
+        journal = get_lookup_journal()
+        return journal.lookup_key(lookup_id, api_keys) if journal is not None else None
+    except sqlite3.Error as e:
+        logger.warning("Could not read the lookup journal: %s", e)
+        return None
@@ -0,0 +1,230 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+event_logger = logging.getLogger("personaai.events")
+
+# Constants
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LOOKUP_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 900)
+POLL_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Monotonic counter, optionally split by labels
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+# Value that can go up and down (queue depths, in-flight work), optionally split by labels
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+# Histogram with fixed upper bounds, rendered with cumulative buckets like Prometheus expects
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    # Time the with-block and observe its duration in seconds
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get_count(self, **labels):
+        with self.lock:
+            series = self.series.get(_label_key(self.labelnames, labels))
+            return series["count"] if series else 0
+
+    def samples(self):
+        with self.lock:
+            snapshot = {key: (list(series["counts"]), series["sum"], series["count"])
+                        for key, series in self.series.items()}
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_number(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_number(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+# The metrics exported on /metrics
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    # Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TRIGGER_SECONDS = REGISTRY.histogram(
+    "personaai_trigger_seconds", "Latency of IRBIS psycho_profile trigger calls")
+STATUS_CHECK_SECONDS = REGISTRY.histogram(
+    "personaai_status_check_seconds", "Latency of IRBIS lookup status calls")
+LOOKUP_SECONDS = REGISTRY.histogram(
+    "personaai_lookup_seconds", "Time from the first status check until a lookup finished or failed",
+    buckets=LOOKUP_BUCKETS, labelnames=("outcome",))
+LOOKUP_POLLS = REGISTRY.histogram(
+    "personaai_lookup_polls", "Status checks needed per lookup", buckets=POLL_COUNT_BUCKETS, labelnames=("outcome",))
+FINAL_FETCH_SECONDS = REGISTRY.histogram(
+    "personaai_final_fetch_seconds", "Latency of the status call that returned the finished profile")
+PDF_RENDER_SECONDS = REGISTRY.histogram(
+    "personaai_pdf_render_seconds", "Time to lay out one profile PDF")
+LOOKUPS = REGISTRY.counter(
+    "personaai_lookups_total", "Lookups that stopped polling, by outcome", labelnames=("outcome",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "personaai_cache_requests_total", "Cache lookups, by cache and hit or miss", labelnames=("cache", "result"))
+
+ADMISSION_PENDING = REGISTRY.gauge(
+    "personaai_admission_pending", "Analyses admitted by /analyze and not yet finished")
+ADMISSION_WAITING = REGISTRY.gauge(
+    "personaai_admission_waiting", "Admitted analyses still waiting for a free job worker")
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "personaai_admission_rejections_total", "Analyses turned away by admission control, by reason",
+    labelnames=("reason",))
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+# Record the end of a lookup's polling: histograms, outcome counter and a JSON log event
+def record_lookup(lookup_id, outcome, duration, polls, final_fetch=None):
+    LOOKUP_SECONDS.observe(duration, outcome=outcome)
+    LOOKUP_POLLS.observe(polls, outcome=outcome)
+    LOOKUPS.inc(outcome=outcome)
+    if final_fetch is not None:
+        FINAL_FETCH_SECONDS.observe(final_fetch)
+    log_event("lookup_done", lookup_id=lookup_id, outcome=outcome, duration=round(duration, 3),
+              polls=polls, final_fetch=None if final_fetch is None else round(final_fetch, 3))
+
+
+# Emit one JSON log line on the personaai.events logger, if it is enabled at INFO
+def log_event(event, **fields):
+    if not event_logger.isEnabledFor(logging.INFO):
+        return
+    event_logger.info(json.dumps(dict(fields, event=event, ts=round(time.time(), 3)), default=str))
+
+
+# Logs events as bare JSON lines, one per record
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return record.getMessage()
+
+
+# Set the log level from PERSONAAI_LOG_LEVEL (WARNING by default) and, with
+# PERSONAAI_JSON_LOGS=1, write lifecycle events as JSON lines to stderr
+def configure_logging():
+    level = os.environ.get("PERSONAAI_LOG_LEVEL", "WARNING").upper()
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if os.environ.get("PERSONAAI_JSON_LOGS") == "1" and not event_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonLineFormatter())
+        event_logger.addHandler(handler)
+        event_logger.setLevel(logging.INFO)
+        event_logger.propagate = False
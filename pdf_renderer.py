@@ -0,0 +1,278 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import requests
+from PIL import Image
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, Table, TableStyle
+
+from image_cache import image_cache_from_env
+from metrics import PDF_RENDER_SECONDS, record_cache
+
+logger = logging.getLogger("personaai.pdf")
+
+# Constants
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "icon.png")
+IMAGE_CONNECT_TIMEOUT = 3
+IMAGE_READ_TIMEOUT = 5
+IMAGE_MAX_BYTES = 5 * 1024 * 1024
+IMAGE_MAX_PIXELS = 300  # 2 inches at 150 dpi
+IMAGE_CACHE_SIZE = 256
+IMAGE_FETCH_CONCURRENCY = 4
+IMAGE_FETCH_WAIT = IMAGE_CONNECT_TIMEOUT + IMAGE_READ_TIMEOUT + 5
+IMAGE_FAILURE_TTL = 60  # seconds before a failed download is tried again
+PDF_CACHE_SIZE = 128
+
+# Paragraph styles, built once
+TITLE_STYLE = ParagraphStyle(
+    'Title',
+    fontName="Helvetica-Bold",
+    fontSize=18,
+    textColor=colors.blue,
+    alignment=1,  # Center align
+)
+SUBTITLE_STYLE = ParagraphStyle(
+    'Subtitle',
+    fontName="Helvetica-Bold",
+    fontSize=14,
+    textColor=colors.black,
+)
+TEXT_STYLE = ParagraphStyle(
+    'Text',
+    fontName="Helvetica",
+    fontSize=12,
+    textColor=colors.black,
+)
+HEADER_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+])
+
+
+# Read the logo once; flowables are cheap to rebuild from the cached bytes
+def _load_logo():
+    if not os.path.exists(LOGO_PATH):
+        return None
+    with open(LOGO_PATH, 'rb') as f:
+        return f.read()
+
+
+LOGO_BYTES = _load_logo()
+
+
+# Small thread-safe LRU map
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+# Downloads profile images with timeouts and a size cap, downscales them to the
+# size printed in the PDF and keeps the result in a bounded memory cache in front
+# of an optional on-disk one (image_cache.DiskImageCache). Concurrent requests for
+# the same URL wait for a single download, and a failed download is only
+# remembered for IMAGE_FAILURE_TTL seconds, so a slow image host doesn't drop
+# the picture for good.
+class ImageFetcher:
+    def __init__(self, cache_size=IMAGE_CACHE_SIZE, concurrency=IMAGE_FETCH_CONCURRENCY,
+                 timeout=(IMAGE_CONNECT_TIMEOUT, IMAGE_READ_TIMEOUT), max_bytes=IMAGE_MAX_BYTES, disk_cache=None):
+        self.cache = LRUCache(cache_size)
+        self.failures = LRUCache(cache_size)  # url -> time of the last failed download
+        self.disk_cache = disk_cache
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    # Return downscaled JPEG bytes for url, or None if it can't be fetched in time
+    def fetch(self, url):
+        if not url:
+            return None
+        cached = self.cache.get(url)
+        record_cache("image", cached is not None)
+        if cached is not None:
+            return cached
+        failed_at = self.failures.get(url)
+        if failed_at is not None and time.monotonic() - failed_at < IMAGE_FAILURE_TTL:
+            return None
+
+        with self.lock:
+            done = self.pending.get(url)
+            leader = done is None
+            if leader:
+                done = self.pending[url] = threading.Event()
+        if not leader:
+            done.wait(IMAGE_FETCH_WAIT)
+            return self.cache.get(url) or None
+
+        try:
+            image_bytes = self.disk_cache.get(url) if self.disk_cache is not None else None
+            if self.disk_cache is not None:
+                record_cache("image_disk", image_bytes is not None)
+            if image_bytes is None:
+                image_bytes = self._fetch_thumbnail(url)
+                if image_bytes and self.disk_cache is not None:
+                    self.disk_cache.put(url, image_bytes)
+            if image_bytes:
+                self.cache.put(url, image_bytes)
+            else:
+                self.failures.put(url, time.monotonic())
+        finally:
+            with self.lock:
+                del self.pending[url]
+            done.set()
+        return image_bytes or None
+
+    # Download and downscale one image; b"" if that fails
+    def _fetch_thumbnail(self, url):
+        with self.slots:
+            try:
+                return downscale_image(self._download(url), IMAGE_MAX_PIXELS)
+            except (requests.RequestException, OSError, ValueError) as e:
+                logger.warning("Error fetching profile image %s: %s", url, e)
+                return b""
+
+    def _download(self, url):
+        with self.session.get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ValueError("image too large")
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+
+# Shrink an image to fit max_pixels square and re-encode it as JPEG
+def downscale_image(content, max_pixels):
+    with Image.open(BytesIO(content)) as img:
+        img.thumbnail((max_pixels, max_pixels))
+        output = BytesIO()
+        img.convert("RGB").save(output, format="JPEG", quality=85)
+        return output.getvalue()
+
+
+_image_fetcher = None
+_image_fetcher_lock = threading.Lock()
+_pdf_cache = LRUCache(PDF_CACHE_SIZE)
+
+
+# Shared fetcher, backed by the on-disk thumbnail cache (see image_cache_from_env)
+def get_image_fetcher():
+    global _image_fetcher
+    with _image_fetcher_lock:
+        if _image_fetcher is None:
+            _image_fetcher = ImageFetcher(disk_cache=image_cache_from_env())
+    return _image_fetcher
+
+
+# Content hash of everything that ends up in the PDF, including the picture (b"" for none)
+def profile_digest(profile, image_bytes=b""):
+    digest = hashlib.sha256(profile.dumps().encode())
+    digest.update(hashlib.sha256(image_bytes).digest())
+    return digest.hexdigest()
+
+
+# Render a profile report, returning (pdf_bytes, digest); repeat renders are served from cache.
+# A report rendered while its picture couldn't be fetched gets its own digest, so the
+# next export after the image host recovers renders it again with the picture.
+def render_profile_pdf(profile):
+    image_bytes = get_image_fetcher().fetch(profile.image_url) or b""
+    digest = profile_digest(profile, image_bytes)
+    pdf = _pdf_cache.get(digest)
+    record_cache("pdf", pdf is not None)
+    if pdf is None:
+        with PDF_RENDER_SECONDS.time():
+            pdf = build_profile_pdf(profile, image_bytes)
+        _pdf_cache.put(digest, pdf)
+    return pdf, digest
+
+
+# Lay out the report flowables for a profile_model.Profile. image_bytes can be passed in when
+# the image was fetched elsewhere (b"" for none); otherwise it comes from the shared fetcher.
+def profile_flowables(profile, image_bytes=None):
+    name = profile.name
+    psycho_portrait = profile.psycho_portrait
+    danger_level = profile.danger_level
+    characteristics = profile.characteristics
+
+    # Elements list to hold the components of the PDF
+    elements = []
+
+    # Logo and App Name as a single row (to align on the same line)
+    if LOGO_BYTES:
+        logo = RLImage(BytesIO(LOGO_BYTES), 0.8*inch, 0.8*inch)
+        title = Paragraph("PersonaAI", TITLE_STYLE)
+        table = Table([[logo, title]], colWidths=[1*inch, 4*inch])
+        table.setStyle(HEADER_TABLE_STYLE)
+        elements.append(table)
+        elements.append(Spacer(1, 12))
+    else:
+        elements.append(Paragraph("PersonaAI", TITLE_STYLE))
+        elements.append(Spacer(1, 20))
+
+    # Add profile image if it could be fetched
+    if image_bytes is None:
+        image_bytes = get_image_fetcher().fetch(profile.image_url)
+    if image_bytes:
+        elements.append(RLImage(BytesIO(image_bytes), 2*inch, 2*inch))
+        elements.append(Spacer(1, 20))
+
+    # Add Name
+    elements.append(Paragraph(f"<b>{name}</b>", SUBTITLE_STYLE))
+    elements.append(Spacer(1, 12))
+
+    # Add PsychoPortrait with extra space
+    elements.append(Paragraph(f"🧠 <b>PsychoPortrait:</b>", SUBTITLE_STYLE))
+    elements.append(Spacer(1, 6))
+    elements.append(Paragraph(psycho_portrait, TEXT_STYLE))
+    elements.append(Spacer(1, 12))
+
+    # Add Level of Danger
+    elements.append(Paragraph(f"⚠️ <b>Level Of Danger:</b> <span color='{colors.green if profile.low_danger else colors.red}'>{danger_level}</span>", SUBTITLE_STYLE))
+    elements.append(Spacer(1, 12))
+
+    # Add Predicted Characteristics
+    elements.append(Paragraph(f"🔍 <b>Predicted Characteristics:</b>", SUBTITLE_STYLE))
+    elements.append(Spacer(1, 6))
+    for characteristic in characteristics:
+        elements.append(Paragraph(f"- {characteristic}", TEXT_STYLE))
+
+    return elements
+
+
+def build_profile_pdf(profile, image_bytes=None):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    doc.build(profile_flowables(profile, image_bytes))
+    return buffer.getvalue()
@@ -1,109 +1,83 @@
 import argparse
-import requests
 import time
-import os
 from datetime import datetime
-from cryptography.fernet import Fernet
-from tqdm import tqdm
-import pyfiglet
 import colorama
 from colorama import Fore, Style
-import re
+import contextlib
+import textwrap
+import sys
+from credentials import get_credentials
+from key_pool import mask_key
+from account_cache import get_account_cache
+from result_cache import get_result_cache
+from facebook_ids import normalize_facebook_id, read_ids
+from profile_model import Profile
+from lookup_journal import record_trigger, record_outcome, unfinished_lookup, DONE, FAILED, GAVE_UP
+from search_index import get_search_index, index_profile
+from metrics import configure_logging, record_lookup
 
 # Constants
-API_KEY_FILE = "apikey.txt"
-KEY_FILE = "secret.key"
-PSYCHO_PROFILE_URL = "https://irbis.espysys.com/api/developer/psycho_profile"
-RESULTS_URL_TEMPLATE = "https://irbis.espysys.com/api/request-monitor/api-usage/{}?key={}"
-
-# Function to generate a new encryption key
-def generate_key():
-    key = Fernet.generate_key()
-    with open(KEY_FILE, 'wb') as key_file:
-        key_file.write(key)
-
-# Function to load the encryption key
-def load_key():
-    if not os.path.exists(KEY_FILE):
-        generate_key()
-    return open(KEY_FILE, 'rb').read()
-
-# Function to encrypt the API key
-def encrypt_message(message):
-    key = load_key()
-    encoded_message = message.encode()
-    f = Fernet(key)
-    encrypted_message = f.encrypt(encoded_message)
-    return encrypted_message
-
-# Function to decrypt the API key
-def decrypt_message(encrypted_message):
-    key = load_key()
-    f = Fernet(key)
-    decrypted_message = f.decrypt(encrypted_message)
-    return decrypted_message.decode()
+SEARCH_RESULTS_PER_PAGE = 10
+
+# Heavy modules (requests, pyfiglet, tqdm, aiohttp, reportlab) are imported inside the
+# functions that need them, so commands that stay offline start quickly.
 
 # Function to display the intro with ASCII art
 def show_intro():
+    import pyfiglet
     ascii_art = pyfiglet.figlet_format("PersonaAI", font="slant")
     print(Fore.CYAN + ascii_art + Style.RESET_ALL)
     print(Style.BRIGHT + "Welcome to PersonaAI, your tool for generating AI-based psychological profiles.")
     print("To get started, please enter your IRBIS API key." + Style.RESET_ALL)
 
-# Function to sanitize the API key for display
-def sanitize_api_key(api_key):
-    return f"${'*' * (len(api_key) - 5)}{api_key[-5:]}"
+# Function to validate the API key, answering from the account cache unless refresh is set
+def validate_api_key(api_key, debug_mode=False, refresh=False):
+    account_cache = get_account_cache()
+    if not refresh:
+        account_info = account_cache.get(api_key)
+        if account_info is not None:
+            return account_info
+
+    import requests
+    from irbis_client import get_client
 
-# Function to validate the API key
-def validate_api_key(api_key, debug_mode=False):
-    sanitized_key = sanitize_api_key(api_key)
+    sanitized_key = mask_key(api_key)
     print(f"Validating API key: {sanitized_key}")
-    response = requests.get(
-        f"https://irbis.espysys.com/api/request-monitor/credit-stat?key={api_key}",
-        headers={"Content-Type": "application/json"}
-    )
+    try:
+        response = get_client().credit_stat(api_key)
+    except requests.RequestException as e:
+        print(f"Error validating API key: {e}")
+        return None
     if debug_mode:
         print("Debug Mode: Response from API:")
         print(response.text)
 
     if response.status_code == 200:
         print("API key validated successfully.")
-        return response.json()
+        account_info = response.json()
+        account_cache.put(api_key, account_info)
+        return account_info
     else:
         print(f"Error validating API key: {response.status_code} {response.text}")
+        account_cache.invalidate(api_key)
         return None
 
-# Function to validate Facebook ID
-def validate_facebook_id(facebook_id):
-    # Pattern for numeric ID (e.g., "100077649716158")
-    numeric_pattern = re.compile(r'^\d+$')
-    # Pattern for alphanumeric username with periods (e.g., "itaybar1", "eloy.simoesjr", "gwry.pwmrny.n.l.ymwz.whhzrh")
-    username_pattern = re.compile(r'^[a-zA-Z0-9._-]+$')
-
-    if numeric_pattern.match(facebook_id) or username_pattern.match(facebook_id):
-        return True
-    else:
-        return False
-
 # Function to get the stored API key
 def get_stored_api_key():
-    if os.path.exists(API_KEY_FILE):
-        with open(API_KEY_FILE, 'rb') as file:
-            encrypted_key = file.read()
-            try:
-                return decrypt_message(encrypted_key)
-            except Exception as e:
-                print(f"Error decrypting API key: {e}")
-                return None
-    return None
+    return get_credentials().get_api_key()
 
 # Function to store the API key
 def store_api_key(api_key):
-    encrypted_key = encrypt_message(api_key)
-    with open(API_KEY_FILE, 'wb') as file:
-        file.write(encrypted_key)
+    get_credentials().store_api_key(api_key)
     print("API key encrypted and stored successfully.")
 
+# Function to show the current API key and any other keys in the pool
+def show_api_keys(api_key):
+    print(f"Current API key: {mask_key(api_key)}")
+    for other_key in get_credentials().get_api_keys():
+        if other_key != api_key:
+            print(f"Pool key: {mask_key(other_key)}")
+
 # Function to display account information
 def display_account_info(account_info):
     balance = account_info["balance"]
@@ -124,109 +98,116 @@ def display_command_options():
     print("  -k APIKEY     Replace API key")
     print("  -id FACEBOOK  Facebook ID to analyze")
     print("  -b            Check balance")
-    print("  -d            Debug mode\n")
+    print("  -s            Show current API key")
+    print("  --add-key KEY / --remove-key KEY  Manage extra keys shared by batches and the web app")
+    print("  -q            Quiet mode (no banner)")
+    print("  -d            Debug mode")
+    print("  --batch FILE  Analyze every Facebook ID in FILE (- for stdin)")
+    print("  --export-bulk FILE  Render batch results in FILE to PDF (--format pdf|zip)\n")
 
 # Function to trigger the psycho profile lookup
 def trigger_psycho_profile(api_key, facebook_id, debug_mode=False):
-    payload = {
-        "key": api_key,
-        "lookupType": "PSYCH",
-        "value": facebook_id,
-        "lookupId": 180
-    }
-
-    response = requests.post(
-        PSYCHO_PROFILE_URL,
-        headers={"Content-Type": "application/json"},
-        json=payload
-    )
+    import requests
+    from scheduler import get_scheduler, InsufficientCreditsError
+
+    try:
+        response = get_scheduler().trigger(api_key, facebook_id)
+    except (requests.RequestException, InsufficientCreditsError) as e:
+        print(f"Error initiating profile lookup: {e}")
+        return None
 
     if debug_mode:
         print("Debug Mode: Response from API:")
         print(response.text)
 
     if response.status_code == 201:
-        response_data = response.json()
-        print(f"Profile lookup initiated. ID: {response_data.get('id')}")
-        return response_data.get('id')
+        lookup_id = response.json().get('id')
+        print(f"Profile lookup initiated. ID: {lookup_id}")
+        if lookup_id:
+            record_trigger(facebook_id, lookup_id, api_key)
+        return lookup_id
     else:
         print(f"Error initiating profile lookup: {response.status_code} {response.text}")
         return None
 
 # Function to poll for results
-import textwrap
-import sys
-
-def poll_for_results(api_key, lookup_id, debug_mode=False):
-    url = RESULTS_URL_TEMPLATE.format(lookup_id, api_key)
+def poll_for_results(api_key, lookup_id, debug_mode=False, policy=None):
+    import requests
+    from irbis_client import get_client, lookup_state, profile_ready, LOOKUP_EMPTY, LOOKUP_FINISHED
+    from poll_policy import default_policy
+    from scheduler import get_scheduler
+
+    client = get_client()
+    scheduler = get_scheduler()
+    policy = policy or default_policy()
     attempt_number = 1
     finished_status_count = 0
+    finalizing = False
+    started = time.monotonic()
 
     while True:
-        # Display attempt number before the progress bar
-        print(f"Attempt {attempt_number} to recheck status:")
-
-        for _ in tqdm(range(10), desc="", unit="s", leave=False):
-            time.sleep(1)
+        elapsed = time.monotonic() - started
+        delay = policy.ready_delay() if finalizing else policy.next_delay(attempt_number, elapsed)
+        if policy.expired(elapsed + delay):
+            print("Error: Timed out waiting for the profile analysis to finish. Please try again later.")
+            record_lookup(lookup_id, "timeout", elapsed, attempt_number - 1)
+            record_outcome(lookup_id, GAVE_UP)
+            break
 
-        response = requests.get(url, headers={"Content-Type": "application/json"})
+        # Display attempt number before the progress bar
+        if finalizing:
+            print("Waiting for the final profile data...")
+        else:
+            print(f"Attempt {attempt_number} to recheck status:")
+        wait_with_progress(delay, desc="Finalizing" if finalizing else "")
+
+        time.sleep(scheduler.reserve_poll(api_key))
+        try:
+            response = client.lookup_status(api_key, lookup_id)
+        except requests.RequestException as e:
+            print(f"Error checking status: {e}")
+            attempt_number += 1
+            continue
+        scheduler.note_response(response.status_code, response.headers.get("Retry-After"), api_key)
         if debug_mode:
             print("Debug Mode: Response from API:")
             print(response.text)
 
         if response.status_code == 200:
             data = response.json()
-            if 'data' in data and len(data['data']) == 0:  # Checking if the data list is empty
-                status = data.get('status')
-                if status == "finished":
-                    finished_status_count += 1
-                    if finished_status_count >= 3:
-                        print("""
+            state, record = lookup_state(data)
+            if state == LOOKUP_EMPTY:
+                finished_status_count += 1
+                if finished_status_count >= 3:
+                    print("""
     ***********************************************
     *                                             *
     * Facebook profile is empty or does not exist *
     *                                             *
     ***********************************************
     """)
-                        break
-            elif 'data' in data and len(data['data']) > 0:
-                status = data['data'][0]['status']
-                if status == "FINISHED":
+                    record_lookup(lookup_id, "empty", time.monotonic() - started, attempt_number)
+                    record_outcome(lookup_id, FAILED)
+                    break
+            elif state == LOOKUP_FINISHED:
+                # Return as soon as the profile is written instead of a fixed wait
+                if profile_ready(record):
+                    if not finalizing:
+                        print("\nProfile analysis complete!")
+                    policy.record_completion(time.monotonic() - started)
+                    record_lookup(lookup_id, "finished", time.monotonic() - started, attempt_number,
+                                  response.elapsed.total_seconds())
+                    record_outcome(lookup_id, DONE)
+                    profile = Profile.from_record(record)
+                    print(format_profile(profile))
+                    return profile
+                if not finalizing:
                     print("\nProfile analysis complete!")
-                    print("Waiting 20 seconds before final retrieval...\n")
-                    # Wait an additional 20 seconds before retrieving the final data
-                    for _ in tqdm(range(20), desc="Finalizing", unit="s"):
-                        time.sleep(1)
-
-                    # Retrieve the final data after the timeout
-                    final_response = requests.get(url, headers={"Content-Type": "application/json"})
-                    final_data = final_response.json()
-
-                    if 'data' in final_data and len(final_data['data']) > 0:
-                        profile = final_data['data'][0]['psychAnalyst']['profiles'][0]
-                        danger_level = profile['levelOfDanger'].split(",", 1)
-                        danger_main = danger_level[0] if len(danger_level) > 0 else ""
-                        danger_details = danger_level[1] if len(danger_level) > 1 else ""
-
-                        formatted_output = f"""
-################## Psychological Profile ##################
-Name: {profile['personName']}
-
-PsychoPortrait: {textwrap.fill(profile['psychologicalPortrait'], width=141)}
-
-Level Of Danger: {danger_main}, {textwrap.fill(danger_details, width=141)}
-
-Predicted Characteristics: {', '.join(profile['predictedCharacteristics'])}.
-##########################################################
-"""
-                        print(formatted_output)
-                        break
-                    else:
-                        print("Error: No data available in final retrieval. Please try again later.")
-                        break
-                else:
-                    if debug_mode:
-                        print("Profile analysis is still in progress...")
+                    print("Waiting for the final profile data...\n")
+                    finalizing = True
+            else:
+                if debug_mode:
+                    print("Profile analysis is still in progress...")
         elif response.status_code == 404:
             print("""
     ***********************************************
@@ -235,16 +216,134 @@ Predicted Characteristics: {', '.join(profile['predictedCharacteristics'])}.
     *                                             *
     ***********************************************
     """)
+            record_lookup(lookup_id, "not_found", time.monotonic() - started, attempt_number)
+            record_outcome(lookup_id, FAILED)
             break
         else:
             print(f"Error checking status: {response.status_code} {response.text}")
 
         attempt_number += 1
 
+# Function to sleep with a per-second progress bar
+def wait_with_progress(seconds, desc=""):
+    from tqdm import tqdm
+    whole_seconds = int(seconds)
+    for _ in tqdm(range(whole_seconds), desc=desc, unit="s", leave=False):
+        time.sleep(1)
+    time.sleep(seconds - whole_seconds)
+
+# Function to format a finished profile (a profile_model.Profile) for the terminal
+def format_profile(profile):
+    return f"""
+################## Psychological Profile ##################
+Name: {profile.name}
+
+PsychoPortrait: {textwrap.fill(profile.psycho_portrait, width=141)}
+
+Level Of Danger: {profile.danger_main}, {textwrap.fill(profile.danger_details, width=141)}
+
+Predicted Characteristics: {', '.join(profile.characteristics)}.
+##########################################################
+"""
+
+# Function to print a cached profile; returns False when there is none
+def show_cached_profile(facebook_id):
+    cached = get_result_cache().get(facebook_id)
+    if cached is None:
+        return False
+    print("Using cached profile (run with --no-cache for a fresh analysis).")
+    print(format_profile(cached))
+    return True
+
+# Function to search stored results, after rebuilding the index if asked to
+def run_search_command(args):
+    index = get_search_index()
+    if index is None:
+        print("The search index is turned off (PERSONAAI_SEARCH_INDEX_PATH is empty).")
+        return
+    if args.reindex:
+        index.clear()
+        count = 0
+        for facebook_id, profile in get_result_cache().items():
+            index.add(facebook_id, profile)
+            count += 1
+        print(f"Indexed {count} cached results.")
+    if args.search is None:
+        return
+
+    found = index.search(args.search, danger=args.danger, page=args.page, per_page=SEARCH_RESULTS_PER_PAGE)
+    if not found["total"]:
+        print("No stored results match.")
+        return
+    total = found['total'] if found['total_exact'] else f"More than {found['total']}"
+    print(f"{total} stored results match (page {found['page']} of {found['pages']}):")
+    for result in found["results"]:
+        print(f"\n{Fore.YELLOW}{result['value']}{Style.RESET_ALL} - {result['name']} ({result['danger_level'].split(',', 1)[0]})")
+        if result["snippet"]:
+            print(textwrap.fill(result["snippet"], width=141, initial_indent="  ", subsequent_indent="  "))
+    if found["facets_scope"] == "index":
+        scope = ""
+    else:
+        scope = " among these results" if found["total_exact"] else f" among the first {found['total']}"
+    print(f"\nDanger levels{scope}: " + ", ".join(f"{level} ({count})" for level, count in found["facets"]["danger"].items()))
+
+# Function to analyze a file of Facebook IDs concurrently
+def run_batch_command(api_key, args, results_stream=None):
+    from batch import run_batch, open_ids_source, DEFAULT_BATCH_CONCURRENCY
+    output_file = open(args.output, 'a') if args.output else None
+    source = open_ids_source(args.batch)
+    try:
+        facebook_ids = read_ids(source, on_invalid=lambda value: print(f"Skipping invalid Facebook ID: {value}"))
+        # The validated key goes first; any other keys in the pool share the load
+        api_keys = list(dict.fromkeys([api_key] + get_credentials().get_api_keys()))
+        finished, failed = run_batch(
+            api_keys, facebook_ids, output_file or results_stream,
+            checkpoint_path=args.checkpoint, concurrency=args.concurrency or DEFAULT_BATCH_CONCURRENCY,
+            cache=None if args.no_cache else get_result_cache(),
+            resume=not args.no_cache,
+        )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output_file:
+            output_file.close()
+    print(f"Batch complete: {finished} profiles written, {failed} failed.")
+
+# Function to render batch results into one PDF or a ZIP of PDFs
+def run_bulk_export_command(args):
+    from batch import open_ids_source
+    from bulk_export import build_combined_pdf, iter_zip, read_batch_results, shutdown_render_pool
+    source = open_ids_source(args.export_bulk)
+    try:
+        profiles = list(read_batch_results(source))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    if not profiles:
+        print("No results to export.")
+        return
+
+    output_path = args.output or f"profile_reports.{args.format}"
+    print(f"Rendering {len(profiles)} profiles...")
+    try:
+        with open(output_path, 'wb') as f:
+            if args.format == "zip":
+                for chunk in iter_zip(profiles):
+                    f.write(chunk)
+            else:
+                f.write(build_combined_pdf(profiles))
+    finally:
+        shutdown_render_pool()
+    print(f"Report written to {output_path}")
+
+# Function to print per-request latency in debug mode
+def print_request_latency(method, path, status_code, elapsed):
+    print(f"Debug Mode: {method} {path} -> {status_code} in {elapsed:.3f}s")
+
 # Main function to handle CLI mode
 def main():
     colorama.init(autoreset=True)
-    show_intro()
+    configure_logging()
 
     parser = argparse.ArgumentParser(description="PersonaAI Tool")
     parser.add_argument("-k", "--apikey", type=str, help="Your IRBIS API Key")
@@ -252,12 +351,83 @@ def main():
     parser.add_argument("-s", "--showkey", action="store_true", help="Show current API key")
     parser.add_argument("-b", "--balance", action="store_true", help="Check account balance")
     parser.add_argument("-d", "--debug", action="store_true", help="Enable debug mode")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Skip the banner (for scripts)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached results and run a fresh analysis")
+    parser.add_argument("--batch", type=str, metavar="FILE", help="Analyze every Facebook ID in FILE (one per line, - for stdin)")
+    parser.add_argument("-o", "--output", type=str, metavar="FILE", help="Append batch results as JSON lines to FILE instead of stdout, or write the bulk export to FILE")
+    parser.add_argument("--checkpoint", type=str, metavar="FILE", help="Record batch progress in FILE and resume from it")
+    parser.add_argument("--export-bulk", type=str, metavar="FILE", help="Render batch results in FILE (JSON lines, - for stdin) to PDF")
+    parser.add_argument("--format", choices=["pdf", "zip"], default="pdf", help="Bulk export as one combined PDF or a ZIP of PDFs")
+    parser.add_argument("--concurrency", type=int, help="Maximum batch lookups triggered at once (default 5)")
+    parser.add_argument("--add-key", type=str, metavar="APIKEY", help="Add another IRBIS API key to the key pool")
+    parser.add_argument("--remove-key", type=str, metavar="APIKEY", help="Remove an API key from the key pool")
+    parser.add_argument("--search", type=str, metavar="QUERY", help="Search stored results (empty for the newest); no API key needed")
+    parser.add_argument("--danger", type=str, metavar="LEVEL", help="Only show search results with this danger level (e.g. Low)")
+    parser.add_argument("--page", type=int, default=1, help="Page of search results to show")
+    parser.add_argument("--reindex", action="store_true", help="Rebuild the search index from the result cache")
 
     args = parser.parse_args()
 
+    if args.batch and not args.output:
+        # Keep stdout clean for JSON lines; everything human-readable goes to stderr
+        results_stream = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            run_cli(args, results_stream)
+    else:
+        run_cli(args)
+
+# Function to run the requested CLI command
+def run_cli(args, results_stream=None):
+    if not args.quiet:
+        show_intro()
+
+    # Rendering stored results needs no API key or network access
+    if args.export_bulk:
+        run_bulk_export_command(args)
+        return
+
+    # Neither does searching them
+    if args.reindex or args.search is not None:
+        run_search_command(args)
+        return
+
+    # Showing the stored key stays offline too
+    if args.showkey and not args.apikey:
+        api_key = get_stored_api_key()
+        if api_key:
+            show_api_keys(api_key)
+        else:
+            print("No API key stored. Run the script with the -k option to set one.")
+        return
+
+    if args.remove_key:
+        if get_credentials().remove_api_key(args.remove_key):
+            print(f"Removed {mask_key(args.remove_key)} from the key pool.")
+        else:
+            print("That API key is not stored here (keys set through the environment can't be removed).")
+        return
+
+    if args.add_key:
+        if validate_api_key(args.add_key, debug_mode=args.debug, refresh=True):
+            get_credentials().add_api_key(args.add_key)
+            print(f"Added {mask_key(args.add_key)}; the key pool now has {len(get_credentials().get_api_keys())} keys.")
+        else:
+            print("Invalid API key. Please try again.")
+        return
+
+    # So does a cached profile
+    facebook_id = normalize_facebook_id(args.facebook) if args.facebook else None
+    if facebook_id and not args.apikey and not args.no_cache:
+        if show_cached_profile(facebook_id):
+            return
+
+    if args.debug:
+        from irbis_client import get_client
+        get_client().add_latency_hook(print_request_latency)
+
     if args.apikey:
         api_key = args.apikey
-        account_info = validate_api_key(api_key, debug_mode=args.debug)
+        account_info = validate_api_key(api_key, debug_mode=args.debug, refresh=True)
         if account_info:
             store_api_key(api_key)
             display_account_info(account_info)
@@ -268,7 +438,7 @@ def main():
         api_key = get_stored_api_key()
         if not api_key:
             api_key = input("Enter your API key: ")
-            account_info = validate_api_key(api_key, debug_mode=args.debug)
+            account_info = validate_api_key(api_key, debug_mode=args.debug, refresh=True)
             if account_info:
                 store_api_key(api_key)
                 display_account_info(account_info)
@@ -276,24 +446,44 @@ def main():
                 print("Invalid API key. Please try again.")
                 return
         else:
-            account_info = validate_api_key(api_key, debug_mode=args.debug)
+            # The balance is always fetched live; other commands trust a recent validation
+            account_info = validate_api_key(api_key, debug_mode=args.debug, refresh=args.balance)
             if not account_info:
                 print("Stored API key is invalid. Please run the script with a new API key using the -k option.")
                 return
-            display_account_info(account_info)
+            if not args.quiet:
+                display_account_info(account_info)
 
-    if args.facebook:
-        if validate_facebook_id(args.facebook):
-            lookup_id = trigger_psycho_profile(api_key, args.facebook, debug_mode=args.debug)
-            if lookup_id:
-                poll_for_results(api_key, lookup_id, debug_mode=args.debug)
+    if args.batch or args.facebook:
+        # Start the credit count from the validated account info instead of fetching it again
+        from scheduler import get_scheduler
+        get_scheduler().credits.update(api_key, account_info)
+
+    if args.batch:
+        run_batch_command(api_key, args, results_stream)
+    elif args.facebook:
+        if facebook_id:
+            if args.no_cache or not show_cached_profile(facebook_id):
+                # Poll a lookup an interrupted run already paid for instead of triggering a new one,
+                # unless --no-cache asked for a fresh analysis
+                resumable = None if args.no_cache else unfinished_lookup(facebook_id, [api_key])
+                lookup_id, _ = resumable or (None, None)
+                if lookup_id:
+                    print(f"Resuming lookup {lookup_id} for {facebook_id}.")
+                else:
+                    lookup_id = trigger_psycho_profile(api_key, facebook_id, debug_mode=args.debug)
+                if lookup_id:
+                    profile = poll_for_results(api_key, lookup_id, debug_mode=args.debug)
+                    if profile:
+                        get_result_cache().put(facebook_id, profile)
+                        index_profile(facebook_id, profile)
         else:
-            print("Error: Invalid Facebook ID format. Please use a numeric ID or a valid username.")
+            print("Error: Invalid Facebook ID format. Please use a numeric ID, a username or a profile link.")
     elif args.balance:
         print("Checking balance...")
         display_account_info(account_info)
     elif args.showkey:
-        print(f"Current API key: {sanitize_api_key(api_key)}")
+        show_api_keys(api_key)
     else:
         display_command_options()
 
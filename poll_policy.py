@@ -0,0 +1,117 @@
+import os
+import random
+import statistics
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+
+# Constants
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 15.0
+DEFAULT_BACKOFF_FACTOR = 1.5
+DEFAULT_JITTER = 0.2
+DEFAULT_DEADLINE = 15 * 60
+DEFAULT_HISTORY_SIZE = 50
+DEFAULT_HOT_WINDOW = 10.0
+
+
+# Base poll-interval policy: how long to wait before the next status check
+class PollPolicy(ABC):
+    def __init__(self, deadline=DEFAULT_DEADLINE):
+        self.deadline = deadline
+
+    # Seconds to wait before the given attempt (1-based), `elapsed` seconds into the lookup
+    @abstractmethod
+    def next_delay(self, attempt, elapsed):
+        pass
+
+    # Short interval used while waiting for a FINISHED lookup's profile to be written
+    def ready_delay(self):
+        return self.next_delay(1, 0)
+
+    def expired(self, elapsed):
+        return self.deadline is not None and elapsed >= self.deadline
+
+    # Feed back how long a lookup took from trigger to finished profile
+    def record_completion(self, seconds):
+        pass
+
+
+# The old behaviour: the same pause between every check
+class FixedInterval(PollPolicy):
+    def __init__(self, interval, deadline=DEFAULT_DEADLINE):
+        super().__init__(deadline)
+        self.interval = interval
+
+    def next_delay(self, attempt, elapsed):
+        return self.interval
+
+
+# Exponential backoff between min_interval and max_interval with +/- jitter
+class ExponentialBackoff(PollPolicy):
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 factor=DEFAULT_BACKOFF_FACTOR, jitter=DEFAULT_JITTER, deadline=DEFAULT_DEADLINE):
+        super().__init__(deadline)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+
+    def next_delay(self, attempt, elapsed):
+        delay = self.min_interval * self.factor ** max(attempt - 1, 0)
+        return self._jittered(delay)
+
+    def ready_delay(self):
+        return self._jittered(self.min_interval)
+
+    def _jittered(self, delay):
+        delay = min(delay, self.max_interval)
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(self.min_interval, min(delay, self.max_interval))
+
+
+# Backoff that learns the typical completion time from finished lookups.
+# Before the expected finish it sleeps straight up to the start of a "hot"
+# window, polls at min_interval inside it, and backs off again past it.
+class AdaptiveBackoff(ExponentialBackoff):
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 factor=DEFAULT_BACKOFF_FACTOR, jitter=DEFAULT_JITTER, deadline=DEFAULT_DEADLINE,
+                 history_size=DEFAULT_HISTORY_SIZE, hot_window=DEFAULT_HOT_WINDOW):
+        super().__init__(min_interval, max_interval, factor, jitter, deadline)
+        self.hot_window = hot_window
+        self.history = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+
+    @property
+    def expected_completion(self):
+        with self.lock:
+            if not self.history:
+                return None
+            return statistics.median(self.history)
+
+    def record_completion(self, seconds):
+        with self.lock:
+            self.history.append(seconds)
+
+    def next_delay(self, attempt, elapsed):
+        expected = self.expected_completion
+        if expected is None:
+            return super().next_delay(attempt, elapsed)
+
+        hot_start = expected - self.hot_window
+        if elapsed < hot_start:
+            return self._jittered(hot_start - elapsed)
+        if elapsed <= expected + self.hot_window:
+            return self._jittered(self.min_interval)
+        overdue = elapsed - (expected + self.hot_window)
+        return self._jittered(self.min_interval + overdue * (self.factor - 1))
+
+
+# Default policy, tunable through PERSONAAI_POLL_* environment variables
+def default_policy():
+    return AdaptiveBackoff(
+        min_interval=float(os.environ.get("PERSONAAI_POLL_MIN_INTERVAL", DEFAULT_MIN_INTERVAL)),
+        max_interval=float(os.environ.get("PERSONAAI_POLL_MAX_INTERVAL", DEFAULT_MAX_INTERVAL)),
+        deadline=float(os.environ.get("PERSONAAI_POLL_DEADLINE", DEFAULT_DEADLINE)),
+    )
@@ -0,0 +1,109 @@
+import json
+
+# Constants
+NAME_MISSING = "Name not available"
+NO_DATA = "No data available"
+
+
+# One psychological profile, parsed once from an IRBIS record and keeping only
+# the fields that are shown or exported. __slots__ keeps each instance small
+# when many results sit in the store.
+class Profile:
+    __slots__ = ("name", "psycho_portrait", "danger_level", "characteristics", "image_url")
+
+    def __init__(self, name, psycho_portrait, danger_level, characteristics, image_url=""):
+        self.name = name
+        self.psycho_portrait = psycho_portrait
+        self.danger_level = danger_level  # full text, e.g. "Low, no concerning patterns"
+        self.characteristics = tuple(characteristics)
+        self.image_url = image_url or ""
+
+    # Build from a finished IRBIS record (the item carrying psychAnalyst), or None without a profile
+    @classmethod
+    def from_record(cls, record):
+        return cls.from_analyst((record or {}).get('psychAnalyst') or {})
+
+    @classmethod
+    def from_analyst(cls, analyst):
+        profiles = analyst.get('profiles') or []
+        if not profiles:
+            return None
+        return cls.from_api(profiles[0], analyst.get('image', ''))
+
+    # Build from one entry of psychAnalyst.profiles
+    @classmethod
+    def from_api(cls, profile, image_url=""):
+        return cls(
+            profile.get('personName', NAME_MISSING),
+            profile.get('psychologicalPortrait', NO_DATA),
+            profile.get('levelOfDanger', NO_DATA),
+            profile.get('predictedCharacteristics', []),
+            image_url,
+        )
+
+    # The level itself ("Low") and the explanation after the first comma
+    @property
+    def danger_main(self):
+        return self.danger_level.split(",", 1)[0].strip()
+
+    @property
+    def danger_details(self):
+        parts = self.danger_level.split(",", 1)
+        return parts[1].strip() if len(parts) > 1 else ""
+
+    @property
+    def low_danger(self):
+        return self.danger_main.lower() == "low"
+
+    # IRBIS-shaped profile entry, as written to batch JSONL output
+    def to_api(self):
+        return {
+            "personName": self.name,
+            "psychologicalPortrait": self.psycho_portrait,
+            "levelOfDanger": self.danger_level,
+            "predictedCharacteristics": list(self.characteristics),
+        }
+
+    # Positional form used for storage and content hashing
+    def to_compact(self):
+        return [self.name, self.psycho_portrait, self.danger_level, list(self.characteristics), self.image_url]
+
+    @classmethod
+    def from_compact(cls, values):
+        return cls(*values)
+
+    def dumps(self):
+        return json.dumps(self.to_compact(), separators=(",", ":"), ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, text):
+        return cls.from_compact(json.loads(text))
+
+    def __eq__(self, other):
+        return isinstance(other, Profile) and self.to_compact() == other.to_compact()
+
+    def __repr__(self):
+        return f"Profile(name={self.name!r}, danger_level={self.danger_main!r})"
+
+
+# A finished lookup for one looked-up value, as written to and read from batch JSONL output
+class LookupResult:
+    __slots__ = ("value", "lookup_id", "profile")
+
+    def __init__(self, value, lookup_id, profile):
+        self.value = value
+        self.lookup_id = lookup_id
+        self.profile = profile
+
+    def to_json(self):
+        return json.dumps({
+            "value": self.value,
+            "lookup_id": self.lookup_id,
+            "profile": self.profile.to_api(),
+            "image": self.profile.image_url,
+        })
+
+    @classmethod
+    def from_json(cls, line):
+        data = json.loads(line)
+        return cls(data.get('value'), data.get('lookup_id'), Profile.from_api(data['profile'], data.get('image', '')))
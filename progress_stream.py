@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+
+from jobs import FINISHED, FAILED
+
+logger = logging.getLogger("personaai.progress")
+
+# Constants
+DEFAULT_KEEPALIVE = 15  # seconds between comment lines on an idle stream
+EVENTS_PATH = "/jobs/{job_id}/events"
+
+
+# One server-sent event; the lifecycle step is in the JSON so a plain onmessage sees everything
+def format_event(entry):
+    return f"id: {entry['id']}\ndata: {json.dumps(entry)}\n\n".encode()
+
+
+def is_terminal(entry):
+    return entry["status"] in (FINISHED, FAILED)
+
+
+# Streams job lifecycle events (queued, triggered, poll, status, rendered, finished,
+# failed) as Server-Sent Events. It runs on an asyncio loop rather than in a web
+# worker, so a waiting browser costs one socket instead of a blocked thread.
+# get_job(job_id) returns a jobs.Job or None.
+class ProgressStreamServer:
+    def __init__(self, get_job, host="127.0.0.1", port=5001, keepalive=DEFAULT_KEEPALIVE, allow_origin="*"):
+        self.get_job = get_job
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.allow_origin = allow_origin
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(EVENTS_PATH, self.handle_events)
+        self.runner = web.AppRunner(app, handle_signals=False, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        try:
+            await site.start()
+        except OSError:
+            await self.runner.cleanup()
+            self.runner = None
+            raise
+        # Report the real port when an ephemeral one (0) was asked for
+        self.port = self.runner.addresses[0][1]
+        logger.info("Progress stream listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_events(self, request):
+        job = self.get_job(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({"error": "Job not found."}, status=404,
+                                     headers={"Access-Control-Allow-Origin": self.allow_origin})
+        try:
+            last_seen = int(request.headers.get("Last-Event-ID") or request.query.get("after") or 0)
+        except ValueError:
+            last_seen = 0
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Access-Control-Allow-Origin": self.allow_origin,
+        })
+        await response.prepare(request)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        backlog, unsubscribe = job.subscribe(lambda entry: loop.call_soon_threadsafe(queue.put_nowait, entry))
+        try:
+            for entry in backlog:
+                if entry["id"] > last_seen:
+                    await response.write(format_event(entry))
+                    last_seen = entry["id"]
+                if is_terminal(entry):
+                    return response
+
+            while True:
+                try:
+                    entry = await asyncio.wait_for(queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                if entry["id"] <= last_seen:
+                    continue
+                await response.write(format_event(entry))
+                last_seen = entry["id"]
+                if is_terminal(entry):
+                    return response
+        except ConnectionResetError:
+            # The browser went away; nothing left to send
+            return response
+        finally:
+            unsubscribe()
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import record_cache
+from profile_model import Profile
+from search_index import unindex_values
+
+# Constants
+DEFAULT_CACHE_PATH = "result_cache.db"
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 10000
+
+
+# SQLite-backed cache of finished lookups keyed by the looked-up value, with a TTL
+# and least-recently-used eviction once it holds more than max_entries results.
+# on_evict(values) is called with the values that expired or were evicted, so
+# stores built on the cache (the search index) can drop them too.
+class ResultCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, on_evict=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                value TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                image_url TEXT,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+        self.conn.commit()
+
+    # Return the cached Profile for a value, or None when missing or expired
+    def get(self, value):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload, created_at FROM results WHERE value = ?", (value,)
+            ).fetchone()
+            if row is None:
+                record_cache("result", False)
+                return None
+            payload, created_at = row
+            expired = self.ttl and now - created_at > self.ttl
+            if expired:
+                self.conn.execute("DELETE FROM results WHERE value = ?", (value,))
+            else:
+                self.conn.execute("UPDATE results SET accessed_at = ? WHERE value = ?", (now, value))
+            self.conn.commit()
+        if expired:
+            record_cache("result", False)
+            self._evicted([value])
+            return None
+        record_cache("result", True)
+        return Profile.loads(payload)
+
+    # Store a finished lookup's Profile for a value
+    def put(self, value, profile):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (value, payload, image_url, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (value, profile.dumps(), profile.image_url, now, now),
+            )
+            evicted = self._evict()
+            self.conn.commit()
+        self._evicted(evicted)
+
+    # Delete expired and least recently used entries; returns their values
+    def _evict(self):
+        evicted = []
+        if self.ttl:
+            evicted += self._delete("SELECT value FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            evicted += self._delete(
+                "SELECT value FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?", (self.max_entries,))
+        return evicted
+
+    def _delete(self, select, params):
+        values = [row[0] for row in self.conn.execute(select, params)]
+        self.conn.executemany("DELETE FROM results WHERE value = ?", [(value,) for value in values])
+        return values
+
+    def _evicted(self, values):
+        if values and self.on_evict:
+            self.on_evict(values)
+
+    # (value, Profile) for every unexpired entry, e.g. to rebuild the search index
+    def items(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT value, payload FROM results WHERE ? = 0 OR created_at >= ?",
+                (self.ttl or 0, time.time() - (self.ttl or 0)),
+            ).fetchall()
+        for value, payload in rows:
+            yield value, Profile.loads(payload)
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM results")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_default_cache = None
+
+
+# Shared cache, configured through PERSONAAI_CACHE_* environment variables; what it
+# expires or evicts is dropped from the search index
+def get_result_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache(
+            path=os.environ.get("PERSONAAI_CACHE_PATH", DEFAULT_CACHE_PATH),
+            ttl=float(os.environ.get("PERSONAAI_CACHE_TTL", DEFAULT_TTL)),
+            max_entries=int(os.environ.get("PERSONAAI_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            on_evict=unindex_values,
+        )
+    return _default_cache
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from profile_model import Profile
+
+# Constants
+DEFAULT_MAX_ENTRIES = 1000
+
+
+# Generate an ID for a new stored result
+def new_result_id():
+    return uuid.uuid4().hex
+
+
+# On-disk backend keeping every result (a profile_model.Profile) in a SQLite file
+class SqliteResultBackend:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                result_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def put(self, result_id, profile):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (result_id, data, created_at) VALUES (?, ?, ?)",
+                (result_id, profile.dumps(), time.time()),
+            )
+            self.conn.commit()
+
+    def get(self, result_id):
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM results WHERE result_id = ?", (result_id,)).fetchone()
+        return Profile.loads(row[0]) if row else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Finished results (profile_model.Profile) addressed by result ID: a bounded
+# in-memory LRU in front of an optional on-disk backend, so reads on the hot
+# path don't touch the disk
+class ResultStore:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, result_id, profile):
+        self._remember(result_id, profile)
+        if self.backend is not None:
+            self.backend.put(result_id, profile)
+        return result_id
+
+    def get(self, result_id):
+        with self.lock:
+            profile = self.entries.get(result_id)
+            if profile is not None:
+                self.entries.move_to_end(result_id)
+                return profile
+        if self.backend is None:
+            return None
+        profile = self.backend.get(result_id)
+        if profile is not None:
+            self._remember(result_id, profile)
+        return profile
+
+    def _remember(self, result_id, profile):
+        with self.lock:
+            self.entries[result_id] = profile
+            self.entries.move_to_end(result_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+_default_store = None
+
+
+# Shared store; set PERSONAAI_RESULT_STORE_PATH to also keep results on disk
+def get_result_store():
+    global _default_store
+    if _default_store is None:
+        path = os.environ.get("PERSONAAI_RESULT_STORE_PATH")
+        _default_store = ResultStore(
+            max_entries=int(os.environ.get("PERSONAAI_RESULT_STORE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            backend=SqliteResultBackend(path) if path else None,
+        )
+    return _default_store
@@ -0,0 +1,242 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from irbis_client import IrbisError, get_client
+from key_pool import KeyRouter
+from lookup_journal import lookup_key
+
+logger = logging.getLogger("personaai.scheduler")
+
+# Constants
+DEFAULT_TRIGGER_RATE = 2.0  # lookups started per second
+DEFAULT_TRIGGER_BURST = 5
+DEFAULT_POLL_RATE = 10.0  # status checks per second
+DEFAULT_POLL_BURST = 20
+DEFAULT_CREDIT_REFRESH = 60.0
+DEFAULT_CREDIT_RETRY = 10.0  # seconds before a failed credit-stat call is retried
+DEFAULT_CREDITS_PER_LOOKUP = 1
+DEFAULT_THROTTLE_BACKOFF = 5.0
+MAX_THROTTLE_BACKOFF = 120.0
+MAX_TRIGGER_ATTEMPTS = 3
+
+
+# The account has no credits left for another lookup
+class InsufficientCreditsError(IrbisError):
+    pass
+
+
+# Token bucket; reserve() books tokens and says how long to wait before using them,
+# so the same bucket serves blocking callers (time.sleep) and asyncio ones
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+# Remaining credits per API key from a periodically refreshed credit-stat call,
+# counted down locally between refreshes. One thread refreshes a key at a time
+# while the others carry on with the last known balance, and a failed refresh
+# is not retried for retry_interval seconds.
+class CreditTracker:
+    def __init__(self, client=None, refresh_interval=DEFAULT_CREDIT_REFRESH,
+                 credits_per_lookup=DEFAULT_CREDITS_PER_LOOKUP, retry_interval=DEFAULT_CREDIT_RETRY):
+        self.client = client or get_client()
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.credits_per_lookup = credits_per_lookup
+        self.accounts = {}
+        self.failed_at = {}  # api_key -> when its last refresh failed
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    # Record a credit-stat response (e.g. from validate_api_key) for api_key
+    def update(self, api_key, account_info):
+        with self.lock:
+            self.accounts[api_key] = {
+                "credits": account_info.get("credits"),
+                "balance": account_info.get("balance"),
+                "fetched_at": time.monotonic(),
+            }
+            self.failed_at.pop(api_key, None)
+
+    def get(self, api_key):
+        with self.lock:
+            account = self.accounts.get(api_key)
+            now = time.monotonic()
+            due = (account is None or now - account["fetched_at"] > self.refresh_interval) \
+                and now - self.failed_at.get(api_key, -self.retry_interval) >= self.retry_interval \
+                and api_key not in self.refreshing
+            if due:
+                self.refreshing.add(api_key)
+        if due:
+            try:
+                self.refresh(api_key)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(api_key)
+            with self.lock:
+                account = self.accounts.get(api_key)
+        return account
+
+    def refresh(self, api_key):
+        try:
+            response = self.client.credit_stat(api_key)
+            account_info = response.json() if response.status_code == 200 else None
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Error refreshing credit balance: %s", e)
+            account_info = None
+        if isinstance(account_info, dict):
+            self.update(api_key, account_info)
+        else:
+            with self.lock:
+                self.failed_at[api_key] = time.monotonic()
+
+    # Remaining credits, or None when unknown (then lookups are not blocked)
+    def remaining(self, api_key):
+        account = self.get(api_key)
+        return account["credits"] if account else None
+
+    def consume(self, api_key):
+        with self.lock:
+            account = self.accounts.get(api_key)
+            if account and account["credits"] is not None:
+                account["credits"] -= self.credits_per_lookup
+
+
+# Paces trigger and poll calls with token buckets (one pair per API key, since
+# IRBIS limits each account separately), refuses triggers once an account runs
+# out of credits, and backs off when IRBIS throttles (429) or fails (5xx),
+# honouring Retry-After. A 429 pauses only the key that got it; 5xx pauses all.
+# With several keys, `keys` (a key_pool.KeyRouter) picks the key for each trigger.
+class RequestScheduler:
+    def __init__(self, client=None, trigger_rate=DEFAULT_TRIGGER_RATE, trigger_burst=DEFAULT_TRIGGER_BURST,
+                 poll_rate=DEFAULT_POLL_RATE, poll_burst=DEFAULT_POLL_BURST, credits=None):
+        self.client = client or get_client()
+        self.trigger_rate = trigger_rate
+        self.trigger_burst = trigger_burst
+        self.poll_rate = poll_rate
+        self.poll_burst = poll_burst
+        self.trigger_buckets = {}
+        self.poll_buckets = {}
+        self.credits = credits or CreditTracker(self.client)
+        self.keys = KeyRouter(self.credits)
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self.key_pauses = {}  # api_key -> (paused_until, backoff)
+
+    # Seconds to wait before the next trigger call (bucket plus any throttle pause)
+    def reserve_trigger(self, api_key):
+        remaining = self.credits.remaining(api_key)
+        if remaining is not None and remaining < self.credits.credits_per_lookup:
+            raise InsufficientCreditsError("No credits left on the IRBIS account.")
+        bucket = self._bucket(self.trigger_buckets, api_key, self.trigger_rate, self.trigger_burst)
+        return max(bucket.reserve(), self._pause_left(api_key))
+
+    # Seconds to wait before the next status check made with api_key
+    def reserve_poll(self, api_key=None):
+        bucket = self._bucket(self.poll_buckets, api_key, self.poll_rate, self.poll_burst)
+        return max(bucket.reserve(), self._pause_left(api_key))
+
+    def _bucket(self, buckets, api_key, rate, capacity):
+        with self.lock:
+            bucket = buckets.get(api_key)
+            if bucket is None:
+                bucket = buckets[api_key] = TokenBucket(rate, capacity)
+            return bucket
+
+    def _pause_left(self, api_key=None):
+        now = time.monotonic()
+        with self.lock:
+            key_paused_until = self.key_pauses.get(api_key, (0.0, 0.0))[0]
+            return max(0.0, self.paused_until - now, key_paused_until - now)
+
+    # Feed back an upstream status code so throttling and errors slow callers down
+    def note_response(self, status_code, retry_after=None, api_key=None):
+        pause = None
+        with self.lock:
+            now = time.monotonic()
+            if status_code == 429 and api_key is not None:
+                paused_until, backoff = self.key_pauses.get(api_key, (0.0, 0.0))
+                backoff = min(MAX_THROTTLE_BACKOFF, backoff * 2 or DEFAULT_THROTTLE_BACKOFF)
+                pause = _parse_retry_after(retry_after) or backoff
+                self.key_pauses[api_key] = (max(paused_until, now + pause), backoff)
+            elif status_code == 429 or (status_code is not None and status_code >= 500):
+                self.backoff = min(MAX_THROTTLE_BACKOFF, self.backoff * 2 or DEFAULT_THROTTLE_BACKOFF)
+                pause = _parse_retry_after(retry_after) or self.backoff
+                self.paused_until = max(self.paused_until, now + pause)
+            elif status_code is not None and status_code < 400:
+                self.backoff = 0.0
+                self.key_pauses.pop(api_key, None)
+        if api_key is not None:
+            self.keys.note_response(api_key, status_code, pause)
+
+    # The key to trigger the next lookup with, from api_keys (primary first). The key
+    # counts the lookup as in flight until keys.finish(api_key) is called.
+    def choose_key(self, api_keys):
+        api_key = self.keys.acquire(api_keys)
+        if api_key is None:
+            raise InsufficientCreditsError("No credits left on the IRBIS account." if len(api_keys) == 1
+                                           else "No credits left on any of the IRBIS accounts.")
+        return api_key
+
+    # The key that triggered lookup_id: IRBIS answers status checks only for the owning key.
+    # Falls back to the primary key when neither this process nor the journal knows it.
+    def key_for_lookup(self, lookup_id, api_keys):
+        return self.keys.owner(lookup_id) or lookup_key(lookup_id, api_keys) or api_keys[0]
+
+    # Start a lookup through the shared client, waiting for a trigger slot first.
+    # A 429 was rejected before any credits were spent, so it is retried; other
+    # failures are returned as-is because the lookup may already have been charged.
+    def trigger(self, api_key, facebook_id):
+        for attempt in range(MAX_TRIGGER_ATTEMPTS):
+            time.sleep(self.reserve_trigger(api_key))
+            response = self.client.trigger_psycho_profile(api_key, facebook_id)
+            self.note_response(response.status_code, response.headers.get("Retry-After"), api_key)
+            if response.status_code == 201:
+                self.credits.consume(api_key)
+            if response.status_code != 429:
+                return response
+        return response
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+# Shared scheduler, tunable through PERSONAAI_TRIGGER_RATE and PERSONAAI_POLL_RATE
+def get_scheduler():
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler(
+                trigger_rate=float(os.environ.get("PERSONAAI_TRIGGER_RATE", DEFAULT_TRIGGER_RATE)),
+                poll_rate=float(os.environ.get("PERSONAAI_POLL_RATE", DEFAULT_POLL_RATE)),
+            )
+        return _default_scheduler
@@ -0,0 +1,287 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("personaai.search")
+
+# Constants
+DEFAULT_INDEX_PATH = "search_index.db"
+MAX_FACET_VALUES = 20
+MAX_COUNTED = 1000  # a search's total is counted up to this many matches
+SNIPPET_TOKENS = 24
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+# Local full-text index over finished profiles, in a SQLite file in WAL mode.
+# Name, portrait, danger level and characteristics go into an FTS5 table, and
+# the danger level and each characteristic are also kept as facets, so "which
+# stored results mention X" is an index lookup rather than a scan of the result
+# cache. Profiles are added one at a time as lookups finish, keyed by the
+# looked-up value, so a repeated lookup replaces the older entry. Facet counts
+# over the whole index are kept up to date as entries come and go, so they are
+# never recounted from the documents.
+class SearchIndex:
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id INTEGER PRIMARY KEY,
+                value TEXT NOT NULL UNIQUE,
+                name TEXT NOT NULL,
+                danger_level TEXT NOT NULL,
+                danger_main TEXT NOT NULL,
+                indexed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS documents_danger_main ON documents (danger_main COLLATE NOCASE)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS characteristics (
+                doc_id INTEGER NOT NULL,
+                characteristic TEXT NOT NULL COLLATE NOCASE,
+                PRIMARY KEY (characteristic, doc_id)
+            ) WITHOUT ROWID
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS characteristics_doc_id ON characteristics (doc_id)")
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+            "name, psycho_portrait, danger_level, characteristics, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS facet_counts (
+                facet TEXT NOT NULL,
+                value TEXT NOT NULL COLLATE NOCASE,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (facet, value)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    # Add or replace the entry for a looked-up value
+    def add(self, value, profile):
+        with self.lock:
+            row = self.conn.execute("SELECT doc_id FROM documents WHERE value = ?", (value,)).fetchone()
+            if row is not None:
+                self._delete(row[0])
+            doc_id = self.conn.execute(
+                "INSERT INTO documents (value, name, danger_level, danger_main, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (value, profile.name, profile.danger_level, profile.danger_main, time.time()),
+            ).lastrowid
+            self.conn.execute(
+                "INSERT INTO documents_fts (rowid, name, psycho_portrait, danger_level, characteristics) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (doc_id, profile.name, profile.psycho_portrait, profile.danger_level,
+                 "\n".join(profile.characteristics)),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO characteristics (doc_id, characteristic) VALUES (?, ?)",
+                [(doc_id, characteristic.strip()) for characteristic in profile.characteristics
+                 if characteristic.strip()],
+            )
+            self._count_facets(doc_id, 1)
+            self.conn.commit()
+
+    def remove(self, value):
+        self.remove_many([value])
+
+    # Drop the entries for values, e.g. once the result cache has expired or evicted them
+    def remove_many(self, values):
+        with self.lock:
+            for value in values:
+                row = self.conn.execute("SELECT doc_id FROM documents WHERE value = ?", (value,)).fetchone()
+                if row is not None:
+                    self._delete(row[0])
+            self.conn.commit()
+
+    def _delete(self, doc_id):
+        self._count_facets(doc_id, -1)
+        self.conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+        self.conn.execute("DELETE FROM characteristics WHERE doc_id = ?", (doc_id,))
+        self.conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    # Add delta to the facet counts of one stored document
+    def _count_facets(self, doc_id, delta):
+        facets = [("danger", row[0]) for row in self.conn.execute(
+            "SELECT danger_main FROM documents WHERE doc_id = ?", (doc_id,))]
+        facets += [("characteristic", row[0]) for row in self.conn.execute(
+            "SELECT characteristic FROM characteristics WHERE doc_id = ?", (doc_id,))]
+        self.conn.executemany(
+            "INSERT INTO facet_counts (facet, value, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (facet, value) DO UPDATE SET count = count + excluded.count",
+            [(facet, value, delta) for facet, value in facets],
+        )
+        if delta < 0:
+            self.conn.execute("DELETE FROM facet_counts WHERE count <= 0")
+
+    # One page of entries matching query (words, all of which must appear; the last
+    # may be a prefix), optionally narrowed to a danger level and a characteristic.
+    # Returns {"total", "total_exact", "page", "pages", "results", "facets", "facets_scope"},
+    # best matches first, or newest first without a query. Matches are counted up to
+    # MAX_COUNTED. Facets cover the whole index when nothing narrows the search, and
+    # the same (at most MAX_COUNTED) matches otherwise, so no search counts every match.
+    def search(self, query="", danger=None, characteristic=None, page=1, per_page=20):
+        match = fts_query(query)
+        conditions, params = [], []
+        # CROSS JOIN pins the join order, so the full-text match (or the characteristic
+        # index) drives the query instead of a scan of documents probing it per row
+        if match:
+            source = "FROM documents_fts CROSS JOIN documents d ON d.doc_id = documents_fts.rowid"
+            conditions.append("documents_fts MATCH ?")
+            params.append(match)
+            if characteristic:
+                conditions.append(
+                    "EXISTS (SELECT 1 FROM characteristics c WHERE c.characteristic = ? AND c.doc_id = d.doc_id)")
+                params.append(characteristic)
+        elif characteristic:
+            source = "FROM characteristics c CROSS JOIN documents d ON d.doc_id = c.doc_id"
+            conditions.append("c.characteristic = ?")
+            params.append(characteristic)
+        else:
+            source = "FROM documents d"
+        if danger:
+            conditions.append("d.danger_main = ? COLLATE NOCASE")
+            params.append(danger)
+        if conditions:
+            source += f" WHERE {' AND '.join(conditions)}"
+
+        with self.lock:
+            total_exact = True
+            if match or (danger and characteristic):
+                total = self.conn.execute(
+                    f"SELECT COUNT(*) FROM (SELECT 1 {source} LIMIT {MAX_COUNTED + 1})", params).fetchone()[0]
+                if total > MAX_COUNTED:
+                    total, total_exact = MAX_COUNTED, False
+            elif danger or characteristic:
+                total = self._facet_count("danger" if danger else "characteristic", danger or characteristic)
+            else:
+                total = sum(self._facet_counts("danger", limit=None).values())
+            pages = max(1, (total + per_page - 1) // per_page)
+            page = max(1, min(page, pages))
+            snippet = (f"snippet(documents_fts, 1, '[', ']', '...', {SNIPPET_TOKENS})" if match
+                       else "NULL")
+            # Newer entries have higher doc IDs, which every index here is already ordered by
+            order = "documents_fts.rank" if match else "d.doc_id DESC"
+            rows = self.conn.execute(
+                f"SELECT d.doc_id, d.value, d.name, d.danger_level, d.danger_main, d.indexed_at, {snippet} "
+                f"{source} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [per_page, (page - 1) * per_page],
+            ).fetchall()
+            characteristics = self._characteristics([row[0] for row in rows])
+            if match or danger or characteristic:
+                facets_scope = "matches"
+                facets = self._match_facets(source, params)
+            else:
+                facets_scope = "index"
+                facets = {"danger": self._facet_counts("danger"),
+                          "characteristics": self._facet_counts("characteristic")}
+        results = [{
+            "value": value,
+            "name": name,
+            "danger_level": danger_level,
+            "characteristics": characteristics.get(doc_id, []),
+            "snippet": snippet_text,
+            "indexed_at": indexed_at,
+        } for doc_id, value, name, danger_level, _, indexed_at, snippet_text in rows]
+        return {"total": total, "total_exact": total_exact, "page": page, "pages": pages, "results": results,
+                "facets": facets, "facets_scope": facets_scope}
+
+    # {"danger": {...}, "characteristics": {...}} counted over the first MAX_COUNTED matches
+    def _match_facets(self, source, params):
+        matches = f"SELECT d.doc_id AS doc_id, d.danger_main AS danger_main {source} LIMIT {MAX_COUNTED}"
+        danger = self.conn.execute(
+            f"SELECT danger_main, COUNT(*) FROM ({matches}) GROUP BY danger_main COLLATE NOCASE "
+            f"ORDER BY COUNT(*) DESC LIMIT {MAX_FACET_VALUES}", params).fetchall()
+        characteristics = self.conn.execute(
+            f"SELECT c.characteristic, COUNT(*) FROM ({matches}) m "
+            "JOIN characteristics c ON c.doc_id = m.doc_id GROUP BY c.characteristic "
+            f"ORDER BY COUNT(*) DESC LIMIT {MAX_FACET_VALUES}", params).fetchall()
+        return {"danger": dict(danger), "characteristics": dict(characteristics)}
+
+    def _facet_count(self, facet, value):
+        row = self.conn.execute(
+            "SELECT count FROM facet_counts WHERE facet = ? AND value = ?", (facet, value)).fetchone()
+        return row[0] if row else 0
+
+    # {value: count} for one facet over the whole index, most common first
+    def _facet_counts(self, facet, limit=MAX_FACET_VALUES):
+        query = "SELECT value, count FROM facet_counts WHERE facet = ? ORDER BY count DESC"
+        if limit:
+            query += f" LIMIT {limit}"
+        return dict(self.conn.execute(query, (facet,)).fetchall())
+
+    def _characteristics(self, doc_ids):
+        found = {}
+        if doc_ids:
+            for doc_id, characteristic in self.conn.execute(
+                    "SELECT doc_id, characteristic FROM characteristics "
+                    f"WHERE doc_id IN ({', '.join('?' * len(doc_ids))})", doc_ids):
+                found.setdefault(doc_id, []).append(characteristic)
+        return found
+
+    def __len__(self):
+        with self.lock:
+            return sum(self._facet_counts("danger", limit=None).values())
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM documents_fts")
+            self.conn.execute("DELETE FROM facet_counts")
+            self.conn.execute("DELETE FROM characteristics")
+            self.conn.execute("DELETE FROM documents")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# FTS5 expression for free text: every word quoted, so operators and punctuation
+# are taken literally, and the last one matched as a prefix for search-as-you-type
+def fts_query(text):
+    words = TOKEN_PATTERN.findall(text or "")
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+# Shared index from PERSONAAI_SEARCH_INDEX_PATH; empty turns it off
+def get_search_index():
+    global _default_index
+    path = os.environ.get("PERSONAAI_SEARCH_INDEX_PATH", DEFAULT_INDEX_PATH)
+    if not path:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = SearchIndex(path)
+    return _default_index
+
+
+# Index a finished profile. The index is a convenience on top of the result cache,
+# so a write error is only logged and never fails the lookup.
+def index_profile(value, profile):
+    try:
+        index = get_search_index()
+        if index is not None:
+            index.add(value, profile)
+    except sqlite3.Error as e:
+        logger.warning("Could not index the result for %s: %s", value, e)
+
+
+# Drop values the result cache no longer holds; errors are only logged, as above
+def unindex_values(values):
+    try:
+        index = get_search_index()
+        if index is not None:
+            index.remove_many(values)
+    except sqlite3.Error as e:
+        logger.warning("Could not remove expired results from the search index: %s", e)
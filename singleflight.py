@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+# Constants
+DEFAULT_LEASE = 30 * 60
+DEFAULT_WAIT_FOR_LOOKUP_ID = 30
+WAIT_STEP = 0.25
+
+
+# Coalesces concurrent calls for the same key inside one process: the first
+# caller runs fn() (which returns a Future) and everyone else gets that Future
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    # Return (future, is_leader) for key, starting fn() only if nothing is in flight
+    def run(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.calls[key] = future
+
+        future.add_done_callback(lambda done: self._forget(key, done))
+        try:
+            inner = fn()
+        except Exception as e:
+            future.set_exception(e)
+            return future, True
+
+        def relay(done):
+            try:
+                future.set_result(done.result())
+            except Exception as e:
+                future.set_exception(e)
+
+        inner.add_done_callback(relay)
+        return future, True
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.calls.get(key) is future:
+                del self.calls[key]
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+
+# Lock table in a shared SQLite file so gunicorn workers agree on one lookup per
+# value: the owner triggers and publishes its lookup ID, other workers poll that
+# ID instead of triggering (and paying for) their own
+class SharedLookupTable:
+    def __init__(self, path, lease=DEFAULT_LEASE):
+        self.lease = lease
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS inflight (
+                value TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                lookup_id TEXT,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    # Claim value for this process. Returns None if we now own it (so we must
+    # trigger), otherwise the lookup ID published by the current owner.
+    def acquire(self, value, wait=DEFAULT_WAIT_FOR_LOOKUP_ID):
+        deadline = time.time() + wait
+        while True:
+            now = time.time()
+            with self.lock:
+                self.conn.execute("DELETE FROM inflight WHERE value = ? AND expires_at < ?", (value, now))
+                claimed = self.conn.execute(
+                    "INSERT OR IGNORE INTO inflight (value, owner, lookup_id, expires_at) VALUES (?, ?, NULL, ?)",
+                    (value, self.owner, now + self.lease),
+                ).rowcount
+                if claimed:
+                    return None
+                row = self.conn.execute("SELECT lookup_id FROM inflight WHERE value = ?", (value,)).fetchone()
+                # The owner is still triggering; after waiting long enough, take the claim
+                # over (so our publish and release apply) and trigger ourselves
+                if now >= deadline and not (row and row[0]):
+                    taken = self.conn.execute(
+                        "UPDATE inflight SET owner = ?, expires_at = ? WHERE value = ? AND lookup_id IS NULL",
+                        (self.owner, now + self.lease, value),
+                    ).rowcount
+                    if taken:
+                        return None
+                    continue  # released or published meanwhile; look again
+            if row and row[0]:
+                return row[0]
+            time.sleep(WAIT_STEP)
+
+    # Claim value only if nobody holds it; returns whether we now own it
+    def claim(self, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM inflight WHERE value = ? AND expires_at < ?", (value, now))
+            return bool(self.conn.execute(
+                "INSERT OR IGNORE INTO inflight (value, owner, lookup_id, expires_at) VALUES (?, ?, NULL, ?)",
+                (value, self.owner, now + self.lease),
+            ).rowcount)
+
+    def publish(self, value, lookup_id):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE inflight SET lookup_id = ? WHERE value = ? AND owner = ?",
+                (str(lookup_id), value, self.owner),
+            )
+
+    def release(self, value):
+        with self.lock:
+            self.conn.execute("DELETE FROM inflight WHERE value = ? AND owner = ?", (value, self.owner))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_shared_table = None
+
+
+# Cross-worker lock table, enabled with PERSONAAI_SHARED_INFLIGHT=1
+def get_shared_lookup_table():
+    global _shared_table
+    if _shared_table is None and os.environ.get("PERSONAAI_SHARED_INFLIGHT") == "1":
+        path = os.environ.get("PERSONAAI_INFLIGHT_PATH", "inflight.db")
+        _shared_table = SharedLookupTable(path)
+    return _shared_table
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_irbis import FakeIrbisConfig, FakeIrbisServer  # noqa: E402
+
+# irbis_client reads IRBIS_BASE_URL at import time, so the fake server is started,
+# and every store pointed at a scratch directory, before any test imports the app
+_server = FakeIrbisServer(port=0)
+_server.start()
+_workdir = tempfile.mkdtemp(prefix="personaai-tests-")
+os.environ.update({
+    "IRBIS_BASE_URL": _server.url,
+    "PERSONAAI_CACHE_PATH": os.path.join(_workdir, "result_cache.db"),
+    "PERSONAAI_ACCOUNT_CACHE_PATH": os.path.join(_workdir, "account_cache.json"),
+    "PERSONAAI_JOURNAL_PATH": os.path.join(_workdir, "lookup_journal.db"),
+    "PERSONAAI_SEARCH_INDEX_PATH": os.path.join(_workdir, "search_index.db"),
+    "PERSONAAI_IMAGE_CACHE_DIR": os.path.join(_workdir, "image_cache"),
+    "PERSONAAI_EVENTS_PORT": "0",
+    "PERSONAAI_RESUME_LOOKUPS": "0",
+})
+
+
+# The shared fake IRBIS server, reset to quick, reliable lookups for each test
+@pytest.fixture
+def fake_irbis():
+    _server.state.config = FakeIrbisConfig(delay=0.2, seed=1)
+    _server.state.reset()
+    return _server
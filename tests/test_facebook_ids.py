@@ -0,0 +1,39 @@
+import pytest
+
+from facebook_ids import normalize_facebook_id, read_ids
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("100077649716158", "100077649716158"),
+    ("  100077649716158\n", "100077649716158"),
+    ("Eloy.SimoesJr", "eloy.simoesjr"),
+    ("@itaybar1", "itaybar1"),
+    ("https://www.facebook.com/Eloy.SimoesJr", "eloy.simoesjr"),
+    ("facebook.com/itaybar1/about", "itaybar1"),
+    ("https://m.facebook.com/profile.php?id=100077649716158&ref=bookmarks", "100077649716158"),
+    ("https://fb.com/people/Some-Name/100077649716158/", "100077649716158"),
+    ("https://www.facebook.com/p/Some-Name-100077649716158/", "100077649716158"),
+])
+def test_normalize_accepts_ids_usernames_and_links(value, expected):
+    assert normalize_facebook_id(value) == expected
+
+
+@pytest.mark.parametrize("value", [
+    "",
+    "not an id",
+    "https://example.com/itaybar1",
+    "https://www.facebook.com/",
+    "https://www.facebook.com/groups/123456",
+    "https://www.facebook.com/l.php?u=https%3A%2F%2Fexample.com",
+    "https://www.facebook.com/profile.php?id=abc",
+])
+def test_normalize_rejects_everything_else(value):
+    assert normalize_facebook_id(value) is None
+
+
+def test_read_ids_skips_comments_invalid_rows_and_duplicates():
+    invalid = []
+    lines = ["# header\n", "100077649716158\n", "\n", "not an id\n", "Itaybar1\n",
+             "https://facebook.com/profile.php?id=100077649716158\n", "facebook.com/itaybar1\n"]
+    assert list(read_ids(lines, on_invalid=invalid.append)) == ["100077649716158", "itaybar1"]
+    assert invalid == ["not an id"]
@@ -0,0 +1,102 @@
+import asyncio
+import io
+import json
+import time
+
+import pytest
+
+from async_poller import AsyncPoller
+from batch import Checkpoint, run_batch, DONE, FAILED
+from irbis_client import IrbisError, LookupNotFoundError
+from poll_policy import FixedInterval
+from result_cache import ResultCache
+from scheduler import RequestScheduler
+
+
+def quick_policy():
+    return FixedInterval(0.1, deadline=10)
+
+
+def stats(server):
+    return dict(server.state.stats())
+
+
+async def with_poller(fn, **options):
+    poller = AsyncPoller(policy=quick_policy(), **options)
+    try:
+        return await fn(poller)
+    finally:
+        await poller.close()
+
+
+def test_lookup_is_polled_to_a_profile_and_cached(fake_irbis, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.db"))
+    out = io.StringIO()
+    assert run_batch(["key-cached"], ["100077649716158"], out, policy=quick_policy(), cache=cache) == (1, 0)
+    result = json.loads(out.getvalue())
+    assert result["value"] == "100077649716158"
+    assert cache.get("100077649716158").name == "Test Person 100077649716158"
+
+    # The second run is served from the cache without calling IRBIS
+    triggers = stats(fake_irbis)["trigger"]
+    assert run_batch(["key-cached"], ["100077649716158"], io.StringIO(), policy=quick_policy(), cache=cache) == (1, 0)
+    assert stats(fake_irbis)["trigger"] == triggers
+
+
+def test_empty_profile_fails_and_is_checkpointed(fake_irbis, tmp_path):
+    checkpoint_path = str(tmp_path / "ids.checkpoint")
+    assert run_batch(["key-empty"], ["empty.profile", "4"], io.StringIO(), checkpoint_path=checkpoint_path,
+                     policy=quick_policy()) == (1, 1)
+    checkpoint = Checkpoint(checkpoint_path)
+    assert checkpoint.state("empty.profile") == FAILED
+    assert checkpoint.state("4") == DONE
+    checkpoint.close()
+
+    # A rerun with the checkpoint doesn't try the empty profile again
+    triggers = stats(fake_irbis)["trigger"]
+    assert run_batch(["key-empty"], ["empty.profile", "4"], io.StringIO(), checkpoint_path=checkpoint_path,
+                     policy=quick_policy()) == (0, 0)
+    assert stats(fake_irbis)["trigger"] == triggers
+
+
+def test_unknown_lookup_is_not_found(fake_irbis):
+    with pytest.raises(LookupNotFoundError):
+        asyncio.run(with_poller(lambda poller: poller.poll("key-missing", 999999)))
+
+
+def test_throttled_trigger_honours_retry_after(fake_irbis):
+    fake_irbis.state.config.throttle_rate = 1.0
+    fake_irbis.state.config.retry_after = 0.3
+    scheduler = RequestScheduler()
+    started = time.monotonic()
+    with pytest.raises(IrbisError, match="429"):
+        asyncio.run(with_poller(lambda poller: poller.trigger("key-throttled", "5"), scheduler=scheduler))
+    # Three attempts, each after the previous answer's Retry-After
+    assert stats(fake_irbis)["throttled"] == 3
+    assert time.monotonic() - started >= 0.6
+    # Only the throttled key is paused
+    assert scheduler.reserve_trigger("key-throttled") > 0
+    assert scheduler.reserve_trigger("key-other") == 0
+
+
+def test_journaled_lookup_is_resumed_instead_of_triggered(fake_irbis, capsys):
+    # A lookup triggered by a run that stopped before polling it
+    lookup_id = asyncio.run(with_poller(lambda poller: poller.trigger("key-resume", "resume.me")))
+    triggers = stats(fake_irbis)["trigger"]
+
+    out = io.StringIO()
+    assert run_batch(["key-resume"], ["resume.me"], out, policy=quick_policy()) == (1, 0)
+    assert stats(fake_irbis)["trigger"] == triggers
+    assert str(json.loads(out.getvalue())["lookup_id"]) == str(lookup_id)
+    assert f"Resuming lookup {lookup_id}" in capsys.readouterr().out
+
+    # Once finished, the journal has nothing left to resume and a new run triggers again
+    assert run_batch(["key-resume"], ["resume.me"], io.StringIO(), policy=quick_policy()) == (1, 0)
+    assert stats(fake_irbis)["trigger"] == triggers + 1
+
+
+def test_fresh_batch_does_not_resume(fake_irbis):
+    asyncio.run(with_poller(lambda poller: poller.trigger("key-fresh", "fresh.one")))
+    triggers = stats(fake_irbis)["trigger"]
+    assert run_batch(["key-fresh"], ["fresh.one"], io.StringIO(), policy=quick_policy(), resume=False) == (1, 0)
+    assert stats(fake_irbis)["trigger"] == triggers + 1
@@ -0,0 +1,39 @@
+import search_index
+from profile_model import Profile
+from result_cache import ResultCache
+from search_index import SearchIndex
+
+
+def profile(name, danger, *characteristics):
+    return Profile(name, f"Portrait of {name}, a careful planner.", danger, characteristics)
+
+
+def test_facets_cover_every_match_not_just_the_page(tmp_path):
+    index = SearchIndex(str(tmp_path / "index.db"))
+    for i in range(30):
+        index.add(f"user{i}", profile(f"User {i}", "High, erratic" if i % 3 == 0 else "Low, calm",
+                                      "Curious", "Bold" if i % 2 else "Shy"))
+    found = index.search("careful", per_page=5)
+    assert found["total"] == 30 and found["total_exact"]
+    assert len(found["results"]) == 5
+    assert found["facets_scope"] == "matches"
+    assert found["facets"]["danger"] == {"Low": 20, "High": 10}
+    assert found["facets"]["characteristics"] == {"Curious": 30, "Bold": 15, "Shy": 15}
+
+    narrowed = index.search("careful", danger="high", per_page=5)
+    assert narrowed["total"] == 10
+    assert narrowed["facets"]["characteristics"] == {"Curious": 10, "Bold": 5, "Shy": 5}
+
+
+def test_evicted_results_leave_the_index(tmp_path, monkeypatch):
+    index = SearchIndex(str(tmp_path / "index.db"))
+    monkeypatch.setattr(search_index, "_default_index", index)
+    cache = ResultCache(str(tmp_path / "cache.db"), max_entries=2, on_evict=search_index.unindex_values)
+    for value in ("first", "second", "third"):
+        result = profile(value.title(), "Low, calm", "Curious")
+        cache.put(value, result)
+        index.add(value, result)
+
+    assert cache.get("first") is None
+    assert [result["value"] for result in index.search()["results"]] == ["third", "second"]
+    assert index.search()["facets"]["characteristics"] == {"Curious": 2}